@@ -0,0 +1,72 @@
+"""
+Замер расчета цен: векторный движок (PriceRules) против расчета по одному товару.
+
+Генерирует случайные цены поставщика и рекомендуемые цены WB, считает цены
+обоими способами с общими правилами и проверяет, что результаты совпадают.
+
+Использование:
+    python bench_pricing.py                 # 1 000 000 товаров, 20% с рекомендуемой ценой
+    python bench_pricing.py 200000 0.5
+"""
+
+import os
+import sys
+import time
+
+# Токен не нужен для расчета цен, но Config проверяет его при импорте скрипта
+os.environ.setdefault('WB_API_TOKEN', 'bench')
+
+from update_wb_stocks_prices import (PriceRules, compute_base_prices, compute_prices,
+                                     recommended_price_arrays)
+
+
+def price_per_item(nmid, supplier_price, recommended_prices, rules):
+    """Расчет цены одного товара (как до векторного движка)"""
+    price = int(supplier_price * rules.multiplier)
+    recommended_price = recommended_prices.get(nmid)
+    if recommended_price is not None:
+        # На recommended_offset меньше рекомендуемой, но не меньше min_ratio от базовой
+        price = max(recommended_price - rules.recommended_offset, int(price * rules.min_ratio))
+    return price
+
+
+def main():
+    import numpy as np
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+
+    rng = np.random.default_rng(19)
+    nmids = rng.choice(10 * count, size=count, replace=False).astype(np.int64) + 1
+    supplier_prices = np.round(rng.uniform(10, 50000, size=count), 2)
+    with_recommended = nmids[rng.random(count) < share]
+    recommended_prices = dict(zip(with_recommended.tolist(),
+                                  rng.integers(10, 80000, size=len(with_recommended)).tolist()))
+    rules = PriceRules()
+
+    print(f"[INFO] Товаров: {count}, с рекомендуемой ценой: {len(recommended_prices)}")
+    # Прогрев: pandas импортируется лениво при первом вызове и не должен попасть в замер
+    recommended_price_arrays(nmids[:1], recommended_prices)
+
+    started = time.perf_counter()
+    expected = [price_per_item(nmid, price, recommended_prices, rules)
+                for nmid, price in zip(nmids.tolist(), supplier_prices.tolist())]
+    per_item_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    base_prices = compute_base_prices(supplier_prices, rules)
+    recommended, has_recommended = recommended_price_arrays(nmids, recommended_prices)
+    prices = compute_prices(base_prices, recommended, has_recommended, rules)
+    vectorized_time = time.perf_counter() - started
+
+    mismatches = int(np.count_nonzero(prices != np.array(expected, dtype=np.int64)))
+    print(f"  По одному товару: {per_item_time:.2f} с")
+    print(f"  Векторно:         {vectorized_time:.2f} с")
+    if mismatches:
+        print(f"[ERROR] Цены не совпадают: {mismatches}")
+        sys.exit(1)
+    print("[OK] Цены совпадают")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Замер времени импорта тяжелых библиотек (флаг --import-time).
+
+Тяжелые зависимости (pandas, numpy, openpyxl, selenium) импортируются
+внутри функций того этапа, которому они нужны. Этот модуль показывает,
+какой модуль сколько стоил и когда был загружен.
+
+Использование (до импорта остальных модулей скрипта):
+    if '--import-time' in sys.argv:
+        from import_timing import enable_import_timing
+        enable_import_timing()
+"""
+
+import atexit
+import builtins
+import sys
+import time
+
+
+# Время старта процесса (примерно - момент первого импорта этого модуля)
+_STARTED_AT = time.perf_counter()
+
+# (модуль верхнего уровня, время загрузки в секундах, секунда от старта)
+IMPORT_TIMES = []
+
+_original_import = None
+_in_progress = set()
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """Обертка над __import__: считает время первой загрузки пакетов верхнего уровня"""
+    top_level = name.partition(".")[0]
+    if level or not top_level or top_level in sys.modules or _in_progress:
+        # Уже загружен, относительный импорт или вложенный импорт (учтен в родителе)
+        return _original_import(name, globals, locals, fromlist, level)
+
+    _in_progress.add(top_level)
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _in_progress.discard(top_level)
+        finished = time.perf_counter()
+        IMPORT_TIMES.append((top_level, finished - started, started - _STARTED_AT))
+
+
+def enable_import_timing(report_at_exit=True):
+    """Включает замер импортов; отчет печатается при завершении процесса"""
+    global _original_import
+    if _original_import is not None:
+        return
+    _original_import = builtins.__import__
+    builtins.__import__ = _timed_import
+    if report_at_exit:
+        atexit.register(print_import_report)
+
+
+def print_import_report(min_seconds=0.001):
+    """Печатает время загрузки модулей (самые дорогие - первыми)"""
+    total = sum(seconds for _, seconds, _ in IMPORT_TIMES)
+    print()
+    print("=" * 60)
+    print("[INFO] Время импорта модулей (--import-time)")
+    print("=" * 60)
+    for module, seconds, offset in sorted(IMPORT_TIMES, key=lambda item: item[1], reverse=True):
+        if seconds < min_seconds:
+            continue
+        print(f"  {module:<28} {seconds * 1000:9.1f} мс  (загружен на {offset:.2f} с)")
+    print(f"  {'Всего на импорты':<28} {total * 1000:9.1f} мс")
+    print(f"  {'Время работы процесса':<28} {(time.perf_counter() - _STARTED_AT) * 1000:9.1f} мс")
+    print("=" * 60)
@@ -1365,85 +1365,86 @@ def download_excel_only() -> str:
                 pass
         return None
 
-try:
-    from update_wb_stocks_prices import download_excel_template_automated, Config
+if __name__ == "__main__":
+    try:
+        from update_wb_stocks_prices import download_excel_template_automated, Config
     
-    # Принудительно отключаем headless для теста
-    Config.HEADLESS_BROWSER = False
-    print("=" * 60)
-    print("Тест автоматической загрузки Excel шаблона WB")
-    print("=" * 60)
-    print(f"AUTO_DOWNLOAD_EXCEL: {Config.AUTO_DOWNLOAD_EXCEL}")
-    print(f"HEADLESS_BROWSER: {Config.HEADLESS_BROWSER} (принудительно false для теста)")
-    print(f"TARGET_DIR: {Config.TARGET_DIR}")
-    print("=" * 60)
-    print()
+        # Принудительно отключаем headless для теста
+        Config.HEADLESS_BROWSER = False
+        print("=" * 60)
+        print("Тест автоматической загрузки Excel шаблона WB")
+        print("=" * 60)
+        print(f"AUTO_DOWNLOAD_EXCEL: {Config.AUTO_DOWNLOAD_EXCEL}")
+        print(f"HEADLESS_BROWSER: {Config.HEADLESS_BROWSER} (принудительно false для теста)")
+        print(f"TARGET_DIR: {Config.TARGET_DIR}")
+        print("=" * 60)
+        print()
     
-    if not Config.AUTO_DOWNLOAD_EXCEL:
-        print("[WARN] AUTO_DOWNLOAD_EXCEL отключен в .env")
-        print("Добавьте в .env: AUTO_DOWNLOAD_EXCEL=true")
-        sys.exit(1)
+        if not Config.AUTO_DOWNLOAD_EXCEL:
+            print("[WARN] AUTO_DOWNLOAD_EXCEL отключен в .env")
+            print("Добавьте в .env: AUTO_DOWNLOAD_EXCEL=true")
+            sys.exit(1)
     
-    print("[INFO] Начинаю загрузку Excel шаблона...")
-    print()
+        print("[INFO] Начинаю загрузку Excel шаблона...")
+        print()
     
-    # Проверяем наличие драйверов
-    try:
-        from selenium import webdriver
-        print("[INFO] Selenium импортирован успешно")
-        
-        # Пробуем создать драйвер (без запуска браузера)
+        # Проверяем наличие драйверов
         try:
-            from selenium.webdriver.chrome.options import Options
-            print("[INFO] Chrome options доступны")
-        except:
-            print("[WARN] Chrome options недоступны")
+            from selenium import webdriver
+            print("[INFO] Selenium импортирован успешно")
+        
+            # Пробуем создать драйвер (без запуска браузера)
+            try:
+                from selenium.webdriver.chrome.options import Options
+                print("[INFO] Chrome options доступны")
+            except:
+                print("[WARN] Chrome options недоступны")
             
+            try:
+                from selenium.webdriver.edge.options import Options as EdgeOptions
+                print("[INFO] Edge options доступны")
+            except:
+                print("[WARN] Edge options недоступны")
+        except Exception as e:
+            print(f"[ERROR] Проблема с Selenium: {e}")
+            sys.exit(1)
+    
+        print()
+        print("[INFO] Использую автономную функцию для скачивания...")
+        print("[INFO] Скрипт будет работать автоматически с сохраненными cookies")
+        print()
+    
         try:
-            from selenium.webdriver.edge.options import Options as EdgeOptions
-            print("[INFO] Edge options доступны")
-        except:
-            print("[WARN] Edge options недоступны")
-    except Exception as e:
-        print(f"[ERROR] Проблема с Selenium: {e}")
-        sys.exit(1)
+            # Используем автономную функцию вместо общей
+            result = download_excel_only()
+        except KeyboardInterrupt:
+            print("\n[ERROR] Прервано пользователем")
+            sys.exit(1)
+        except Exception as e:
+            print(f"\n[ERROR] Исключение: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
     
-    print()
-    print("[INFO] Использую автономную функцию для скачивания...")
-    print("[INFO] Скрипт будет работать автоматически с сохраненными cookies")
-    print()
+        print("\n[INFO] download_excel_template_automated() завершился")
     
-    try:
-        # Используем автономную функцию вместо общей
-        result = download_excel_only()
-    except KeyboardInterrupt:
-        print("\n[ERROR] Прервано пользователем")
-        sys.exit(1)
+        if result:
+            print()
+            print("=" * 60)
+            print(f"[SUCCESS] Файл успешно скачан: {result}")
+            print("=" * 60)
+        else:
+            print()
+            print("=" * 60)
+            print("[FAILED] Не удалось скачать файл")
+            print("=" * 60)
+        
+    except ImportError as e:
+        print(f"[ERROR] Ошибка импорта: {e}")
+        print("Убедитесь, что все зависимости установлены:")
+        print("  py -m pip install selenium requests python-dotenv")
     except Exception as e:
-        print(f"\n[ERROR] Исключение: {e}")
+        print(f"[ERROR] Произошла ошибка: {e}")
         import traceback
         traceback.print_exc()
-        sys.exit(1)
-    
-    print("\n[INFO] download_excel_template_automated() завершился")
-    
-    if result:
-        print()
-        print("=" * 60)
-        print(f"[SUCCESS] Файл успешно скачан: {result}")
-        print("=" * 60)
-    else:
-        print()
-        print("=" * 60)
-        print("[FAILED] Не удалось скачать файл")
-        print("=" * 60)
-        
-except ImportError as e:
-    print(f"[ERROR] Ошибка импорта: {e}")
-    print("Убедитесь, что все зависимости установлены:")
-    print("  py -m pip install selenium requests python-dotenv")
-except Exception as e:
-    print(f"[ERROR] Произошла ошибка: {e}")
-    import traceback
-    traceback.print_exc()
 
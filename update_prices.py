@@ -8,15 +8,69 @@
 2. Как модуль: from update_prices import adjust_prices
 """
 
-import openpyxl
-from openpyxl import load_workbook
 import sys
+
+if "--import-time" in sys.argv:
+    # Отчет о времени импорта печатается при завершении скрипта
+    from import_timing import enable_import_timing
+    enable_import_timing()
+
 import os
+import re
 import glob
+import copy
+import hashlib
+import json
+import posixpath
+import shutil
+import struct
+import tempfile
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import unescape
 from pathlib import Path
 
+# openpyxl, numpy и pandas импортируются внутри функций: быстрые пути
+# (манифест, --verify по размеру и mtime) не платят за их загрузку
+
+
+# Пространства имен OOXML, нужные для поиска активного листа
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_DOC_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+# Размер блока при потоковом чтении XML листа
+_XML_CHUNK_SIZE = 1024 * 1024
+
+# Кэш разобранных шаблонов (рядом с шаблоном, ключ - SHA-256 содержимого)
+TEMPLATE_CACHE_DIR = ".wb_template_cache"
+# Сколько последних использованных записей кэша хранить (старые удаляются)
+TEMPLATE_CACHE_KEEP = 8
+
+# Манифест обработанных шаблонов (в каждой директории с шаблонами)
+TEMPLATE_MANIFEST_FILE = ".wb_template_manifest.json"
 
-def adjust_prices(file_path, column_n=14, column_j=10, verbose=False):
+# Колонки шаблона в памяти/кэше: nmID (C), цена (J), рекомендуемая цена (N)
+# и скорректированная цена (J = N - 1, либо исходная J, если в N не число)
+TEMPLATE_DTYPE = [
+    ("nmid", "<i8"),
+    ("price", "<f8"),
+    ("recommended", "<f8"),
+    ("adjusted", "<f8"),
+]
+
+# Встроенные форматы дат и времени Excel (numFmtId), которые openpyxl читает как даты
+_BUILTIN_DATE_FORMATS = frozenset(range(14, 23)) | {45, 46, 47}
+# Литералы в кавычках и блоки [...] (цвет, локаль), кроме [h], [mm], [ss] - не часть даты
+_DATE_FORMAT_STRIP_RE = re.compile(r'".*?"|\[(?!hh?\]|mm?\]|ss?\])[^\]]*\]')
+_DATE_FORMAT_RE = re.compile(r'(?<![_\\])[dmhysDMHYS]')
+
+_ATTR_RE = re.compile(rb'([\w:]+)\s*=\s*(["\'])(.*?)\2', re.S)
+_T_ATTR_RE = re.compile(rb'\s+t\s*=\s*(["\']).*?\1', re.S)
+
+
+def adjust_prices(file_path, column_n=14, column_j=10, verbose=False, engine="xml"):
     """
     Корректирует цены в Excel файле: устанавливает колонку J = N - 1
     
@@ -25,6 +79,8 @@ def adjust_prices(file_path, column_n=14, column_j=10, verbose=False):
         column_n: Номер колонки N (по умолчанию 14)
         column_j: Номер колонки J (по умолчанию 10)
         verbose: Показывать детальный вывод
+        engine: "xml" - правка XML листа внутри xlsx без пересборки книги,
+                "openpyxl" - полная загрузка и сохранение через openpyxl
     
     Returns:
         Количество измененных строк
@@ -32,6 +88,16 @@ def adjust_prices(file_path, column_n=14, column_j=10, verbose=False):
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Файл не найден: {file_path}")
     
+    if engine == "xml":
+        try:
+            return _adjust_prices_xml(file_path, column_n, column_j, verbose)
+        except (ValueError, KeyError, IndexError, zipfile.BadZipFile, ET.ParseError) as e:
+            # Нестандартная структура файла - используем openpyxl
+            if verbose:
+                print(f"XML-правка недоступна ({e}), используем openpyxl")
+    
+    from openpyxl import load_workbook
+    
     # Открываем файл
     wb = load_workbook(file_path)
     ws = wb.active
@@ -68,6 +134,746 @@ def adjust_prices(file_path, column_n=14, column_j=10, verbose=False):
     return changes_count
 
 
+def _column_letter(column):
+    """Преобразует номер колонки в буквенное обозначение (14 -> N)"""
+    letters = ""
+    while column > 0:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def _column_index(letters):
+    """Преобразует буквенное обозначение колонки в номер (b"N" -> 14)"""
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + (char - ord("A") + 1)
+    return index
+
+
+def _format_xml_number(value):
+    """Форматирует число для записи в <v> (целые значения без дробной части)"""
+    if value.is_integer():
+        return str(int(value)).encode()
+    return repr(value).encode()
+
+
+def _resolve_part(base_dir, target):
+    """Возвращает путь части пакета по Target из файла связей"""
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def _find_active_sheet(zin):
+    """
+    Находит XML активного листа внутри xlsx.
+    
+    Returns:
+        Кортеж (путь_к_листу, путь_к_workbook.xml)
+    """
+    root_rels = ET.fromstring(zin.read("_rels/.rels"))
+    workbook_path = None
+    for rel in root_rels.iter(f"{{{_NS_PKG_REL}}}Relationship"):
+        if rel.get("Type", "").endswith("/officeDocument"):
+            workbook_path = _resolve_part("", rel.get("Target"))
+            break
+    if workbook_path is None:
+        raise ValueError("в пакете не найден workbook.xml")
+    
+    workbook_dir = posixpath.dirname(workbook_path)
+    workbook_rels_path = posixpath.join(workbook_dir, "_rels", posixpath.basename(workbook_path) + ".rels")
+    
+    workbook = ET.fromstring(zin.read(workbook_path))
+    sheets = workbook.findall(f"{{{_NS_MAIN}}}sheets/{{{_NS_MAIN}}}sheet")
+    if not sheets:
+        raise ValueError("в книге нет листов")
+    
+    active_tab = 0
+    view = workbook.find(f"{{{_NS_MAIN}}}bookViews/{{{_NS_MAIN}}}workbookView")
+    if view is not None:
+        active_tab = int(view.get("activeTab", 0))
+    if active_tab >= len(sheets):
+        active_tab = 0
+    rel_id = sheets[active_tab].get(f"{{{_NS_DOC_REL}}}id")
+    
+    rels = ET.fromstring(zin.read(workbook_rels_path))
+    for rel in rels.iter(f"{{{_NS_PKG_REL}}}Relationship"):
+        if rel.get("Id") == rel_id:
+            return _resolve_part(workbook_dir, rel.get("Target")), workbook_path
+    raise ValueError(f"не найдена связь {rel_id} для активного листа")
+
+
+def _read_shared_strings(zin, workbook_path):
+    """Читает таблицу общих строк (sharedStrings.xml) в список"""
+    path = posixpath.join(posixpath.dirname(workbook_path), "sharedStrings.xml")
+    if path not in zin.namelist():
+        return []
+    
+    strings = []
+    with zin.open(path) as f:
+        for _, elem in ET.iterparse(f):
+            if elem.tag == f"{{{_NS_MAIN}}}si":
+                # Простая строка - <si><t>, форматированная - набор <si><r><t>
+                # (фонетические подсказки <rPh> в значение ячейки не входят)
+                text = elem.find(f"{{{_NS_MAIN}}}t")
+                if text is not None:
+                    strings.append(text.text or "")
+                else:
+                    strings.append("".join(
+                        t.text or "" for t in elem.findall(f"{{{_NS_MAIN}}}r/{{{_NS_MAIN}}}t")
+                    ))
+                elem.clear()
+    return strings
+
+
+def _is_date_format(format_code):
+    """Формат числа - дата или время (как openpyxl: по первой секции формата)"""
+    format_code = _DATE_FORMAT_STRIP_RE.sub("", format_code.split(";")[0])
+    return _DATE_FORMAT_RE.search(format_code) is not None
+
+
+def _read_date_styles(zin, workbook_path):
+    """Номера стилей ячеек (атрибут s), у которых формат числа - дата или время"""
+    path = posixpath.join(posixpath.dirname(workbook_path), "styles.xml")
+    if path not in zin.namelist():
+        return set()
+    
+    styles = ET.fromstring(zin.read(path))
+    date_formats = set(_BUILTIN_DATE_FORMATS)
+    for num_fmt in styles.iterfind(f"{{{_NS_MAIN}}}numFmts/{{{_NS_MAIN}}}numFmt"):
+        num_fmt_id = int(num_fmt.get("numFmtId"))
+        if _is_date_format(num_fmt.get("formatCode", "")):
+            date_formats.add(num_fmt_id)
+        else:
+            # Свой формат может переопределить встроенный номер
+            date_formats.discard(num_fmt_id)
+    return {
+        index for index, xf in enumerate(styles.iterfind(f"{{{_NS_MAIN}}}cellXfs/{{{_NS_MAIN}}}xf"))
+        if int(xf.get("numFmtId", "0")) in date_formats
+    }
+
+
+# Локальный заголовок части zip: сигнатура, версия, флаги, метод, время, дата,
+# CRC, размеры, длины имени и extra поля (30 байт)
+_ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_ZIP_LOCAL_SIGNATURE = b"PK\x03\x04"
+_ZIP_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+
+
+def _zip_member_length(zin, info):
+    """
+    Длина части в архиве по ее локальному заголовку: заголовок, имя, extra
+    поле, сжатые данные и дескриптор данных (если он есть, флаг 0x08).
+    """
+    zin.fp.seek(info.header_offset)
+    header = zin.fp.read(_ZIP_LOCAL_HEADER.size)
+    if len(header) != _ZIP_LOCAL_HEADER.size or header[:4] != _ZIP_LOCAL_SIGNATURE:
+        raise zipfile.BadZipFile(f"некорректный локальный заголовок части {info.filename}")
+    fields = _ZIP_LOCAL_HEADER.unpack(header)
+    length = _ZIP_LOCAL_HEADER.size + fields[9] + fields[10] + info.compress_size
+    if info.flag_bits & 0x08:
+        # Дескриптор: CRC и размеры (12 байт), иногда с сигнатурой впереди
+        zin.fp.seek(info.header_offset + length)
+        length += 16 if zin.fp.read(4) == _ZIP_DESCRIPTOR_SIGNATURE else 12
+    return length
+
+
+def _copy_zip_member_raw(zin, zout, info):
+    """
+    Копирует часть пакета побайтно: локальный заголовок, сжатые данные и
+    дескриптор данных переносятся без распаковки и повторного сжатия.
+    
+    zipfile не умеет этого публично, поэтому запись идет напрямую в zout.fp,
+    а запись о части добавляется в центральный каталог zout. Результат
+    проверяется после записи архива (см. _adjust_prices_xml).
+    """
+    remaining = _zip_member_length(zin, info)
+    out_info = copy.copy(info)
+    out_info.header_offset = zout.fp.tell()
+    zin.fp.seek(info.header_offset)
+    while remaining > 0:
+        chunk = zin.fp.read(min(remaining, _XML_CHUNK_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile(f"часть {info.filename} обрезана")
+        zout.fp.write(chunk)
+        remaining -= len(chunk)
+    zout.filelist.append(out_info)
+    zout.NameToInfo[out_info.filename] = out_info
+    zout.start_dir = zout.fp.tell()
+    zout._didModify = True
+
+
+def _adjust_prices_xml(file_path, column_n, column_j, verbose):
+    """
+    Корректирует цены правкой XML активного листа прямо внутри xlsx.
+    
+    XML листа читается потоково, переписываются только ячейки колонки J,
+    все остальные части пакета (стили, общие строки, другие листы)
+    копируются побайтно, без распаковки. Время работы зависит только от
+    размера листа.
+    
+    Returns:
+        Количество измененных строк
+    
+    Raises:
+        ValueError: Если структура листа не поддерживается (нужен openpyxl)
+    """
+    letter_j = _column_letter(column_j).encode()
+    changes_count = 0
+    formulas_removed = False
+    shared_strings = None
+    date_styles = None
+    
+    with zipfile.ZipFile(file_path) as zin:
+        sheet_path, workbook_path = _find_active_sheet(zin)
+        
+        with zin.open(sheet_path) as src:
+            first_chunk = src.read(_XML_CHUNK_SIZE)
+            # Префикс пространства имен (например, "x:"), если генератор его использует
+            root_match = re.search(rb'<(\w+:)?worksheet\b', first_chunk)
+            if not root_match:
+                raise ValueError("не найден корневой элемент worksheet")
+            prefix = re.escape(root_match.group(1) or b"")
+            row_re = re.compile(rb'<' + prefix + rb'row\b([^>]*?)(/>|>(.*?)</' + prefix + rb'row>)', re.S)
+            cell_re = re.compile(rb'<' + prefix + rb'c\b([^>]*?)(?:/>|>(.*?)</' + prefix + rb'c>)', re.S)
+            value_re = re.compile(rb'<' + prefix + rb'v>(.*?)</' + prefix + rb'v>', re.S)
+            text_re = re.compile(rb'<' + prefix + rb't\b[^>]*>(.*?)</' + prefix + rb't>', re.S)
+            formula_re = re.compile(rb'<' + prefix + rb'f\b([^>]*)', re.S)
+            row_close = b"</" + (root_match.group(1) or b"") + b"row>"
+            cell_open = b"<" + (root_match.group(1) or b"") + b"c"
+            v_open = b"<" + (root_match.group(1) or b"") + b"v>"
+            v_close = b"</" + (root_match.group(1) or b"") + b"v>"
+            c_close = b"</" + (root_match.group(1) or b"") + b"c>"
+            
+            def cell_value_n(attrs, body):
+                """Значение ячейки N так, как его видит openpyxl (формулы - не числа)"""
+                nonlocal shared_strings, date_styles
+                if body is None or formula_re.search(body):
+                    return None
+                cell_type = attrs.get(b"t", b"n")
+                if cell_type == b"inlineStr":
+                    return unescape(b"".join(text_re.findall(body)).decode("utf-8"))
+                match = value_re.search(body)
+                if not match:
+                    return None
+                raw = unescape(match.group(1).decode("utf-8"))
+                if cell_type == b"s":
+                    if shared_strings is None:
+                        shared_strings = _read_shared_strings(zin, workbook_path)
+                    return shared_strings[int(raw)]
+                if cell_type == b"b":
+                    return raw == "1"
+                if cell_type == b"n":
+                    style = attrs.get(b"s")
+                    if style is not None:
+                        # Число в формате даты openpyxl читает как дату - это не цена
+                        if date_styles is None:
+                            date_styles = _read_date_styles(zin, workbook_path)
+                        if int(style) in date_styles:
+                            return None
+                    return raw
+                # Ошибки (#N/A), даты и строки формул не являются ценами
+                return None
+            
+            def patch_row(row_match):
+                nonlocal changes_count, formulas_removed
+                if row_match.group(2) == b"/>":
+                    return row_match.group(0)
+                row_attrs = dict((k, v) for k, _, v in _ATTR_RE.findall(row_match.group(1)))
+                body = row_match.group(3)
+                
+                cells = []
+                for cell_match in cell_re.finditer(body):
+                    attrs = dict((k, v) for k, _, v in _ATTR_RE.findall(cell_match.group(1)))
+                    ref = attrs.get(b"r")
+                    if ref is None:
+                        raise ValueError("ячейки без атрибута r не поддерживаются")
+                    cells.append((_column_index(ref.rstrip(b"0123456789")), attrs, cell_match))
+                
+                value_n = next((cell_value_n(attrs, m.group(2)) for col, attrs, m in cells if col == column_n), None)
+                if value_n is None:
+                    return row_match.group(0)
+                try:
+                    new_value_j = float(value_n) - 1
+                except (ValueError, TypeError):
+                    if verbose:
+                        print(f"Строка {row_attrs.get(b'r', b'?').decode()}: значение в N не является числом ({value_n}), пропускаем")
+                    return row_match.group(0)
+                
+                value_xml = v_open + _format_xml_number(new_value_j) + v_close
+                cell_j = next(((attrs, m) for col, attrs, m in cells if col == column_j), None)
+                if cell_j is not None:
+                    attrs, m = cell_j
+                    old_body = m.group(2) or b""
+                    formula = formula_re.search(old_body)
+                    if formula:
+                        if b"ref" in formula.group(1):
+                            raise ValueError("в колонке J есть общая формула")
+                        formulas_removed = True
+                    new_cell = cell_open + _T_ATTR_RE.sub(b"", m.group(1)) + b">" + value_xml + c_close
+                    body = body[:m.start()] + new_cell + body[m.end():]
+                else:
+                    row_number = row_attrs.get(b"r")
+                    if row_number is None:
+                        raise ValueError("строки без атрибута r не поддерживаются")
+                    new_cell = cell_open + b' r="' + letter_j + row_number + b'">' + value_xml + c_close
+                    position = next((m.start() for col, attrs, m in cells if col > column_j), len(body))
+                    body = body[:position] + new_cell + body[position:]
+                
+                changes_count += 1
+                if verbose:
+                    print(f"Строка {row_attrs.get(b'r', b'?').decode()}: N={float(value_n)} -> J={new_value_j}")
+                start = row_match.start(3) - row_match.start(0)
+                end = row_match.end(3) - row_match.start(0)
+                row_xml = row_match.group(0)
+                return row_xml[:start] + body + row_xml[end:]
+            
+            # Новый XML листа пишем во временный файл (в памяти, пока он небольшой),
+            # а затем собираем пакет в исходном порядке частей
+            patched_sheet = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+            buffer = first_chunk
+            while True:
+                chunk = src.read(_XML_CHUNK_SIZE)
+                if chunk:
+                    buffer += chunk
+                    end = buffer.rfind(row_close)
+                    if end == -1:
+                        continue
+                    end += len(row_close)
+                    head, buffer = buffer[:end], buffer[end:]
+                else:
+                    head, buffer = buffer, b""
+                patched_sheet.write(row_re.sub(patch_row, head))
+                if not chunk:
+                    break
+        
+        # Если из J удалены формулы, цепочка вычислений (calcChain) становится
+        # некорректной - Excel пересоздаст ее сам
+        workbook_dir = posixpath.dirname(workbook_path)
+        calc_chain_path = posixpath.join(workbook_dir, "calcChain.xml")
+        workbook_rels_path = posixpath.join(workbook_dir, "_rels", posixpath.basename(workbook_path) + ".rels")
+        drop_calc_chain = formulas_removed and calc_chain_path in zin.namelist()
+        
+        # Части zip64 (больше 4 ГБ) переписываются штатно - их extra поля zipfile дополняет сам
+        raw_copy = all(
+            max(info.file_size, info.compress_size, info.header_offset) < zipfile.ZIP64_LIMIT
+            for info in zin.infolist()
+        )
+        
+        sheet_size = patched_sheet.tell()
+        
+        def write_package(path, raw_copy):
+            with zipfile.ZipFile(path, "w") as zout:
+                for info in zin.infolist():
+                    out_info = copy.copy(info)
+                    if info.filename == sheet_path:
+                        out_info.file_size = sheet_size
+                        patched_sheet.seek(0)
+                        with zout.open(out_info, "w") as dst:
+                            shutil.copyfileobj(patched_sheet, dst)
+                    elif drop_calc_chain and info.filename == calc_chain_path:
+                        continue
+                    elif drop_calc_chain and info.filename == "[Content_Types].xml":
+                        data = re.sub(rb'<Override\b[^>]*PartName="/' + re.escape(calc_chain_path.encode()) + rb'"[^>]*/>', b"", zin.read(info))
+                        zout.writestr(out_info, data)
+                    elif drop_calc_chain and info.filename == workbook_rels_path:
+                        data = re.sub(rb'<Relationship\b[^>]*Target="[^"]*calcChain\.xml"[^>]*/>', b"", zin.read(info))
+                        zout.writestr(out_info, data)
+                    elif raw_copy:
+                        _copy_zip_member_raw(zin, zout, info)
+                    else:
+                        with zin.open(info) as src, zout.open(out_info, "w") as dst:
+                            shutil.copyfileobj(src, dst)
+        
+        fd, tmp_path = tempfile.mkstemp(suffix=".xlsx", dir=os.path.dirname(os.path.abspath(file_path)))
+        os.close(fd)
+        try:
+            if raw_copy:
+                try:
+                    write_package(tmp_path, raw_copy=True)
+                    # Побайтная копия идет в обход zipfile - проверяем архив целиком
+                    with zipfile.ZipFile(tmp_path) as check:
+                        bad_member = check.testzip()
+                    if bad_member is not None:
+                        raise zipfile.BadZipFile(f"часть {bad_member} повреждена")
+                except (zipfile.BadZipFile, zipfile.LargeZipFile, struct.error, zlib.error, EOFError) as e:
+                    print(f"Побайтное копирование частей не удалось ({e}), пересжимаем архив")
+                    raw_copy = False
+            if not raw_copy:
+                write_package(tmp_path, raw_copy=False)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        finally:
+            patched_sheet.close()
+    
+    # Заменяем файл только после закрытия исходного архива (важно для Windows)
+    os.replace(tmp_path, file_path)
+    return changes_count
+
+
+def iter_template_rows(file_path, columns=(3, 10, 14), min_row=2):
+    """
+    Построчно читает шаблон WB в потоковом режиме (read-only).
+    
+    Книга не загружается в память целиком: строки читаются по одной,
+    и из каждой сохраняются только нужные колонки, поэтому расход памяти
+    не зависит от размера шаблона.
+    
+    Args:
+        file_path: Путь к Excel файлу
+        columns: Номера колонок для чтения (по умолчанию C, J, N)
+        min_row: Номер первой строки с данными (по умолчанию 2, первая - заголовок)
+    
+    Yields:
+        Кортеж значений ячеек в порядке columns (None для пустых ячеек)
+    """
+    from openpyxl import load_workbook
+    
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        indexes = [column - 1 for column in columns]
+        for row in ws.iter_rows(min_row=min_row, max_col=max(columns), values_only=True):
+            yield tuple(row[i] if i < len(row) else None for i in indexes)
+    finally:
+        wb.close()
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """Вычисляет SHA-256 содержимого файла (hex)"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _numeric_column(values):
+    """Преобразует значения ячеек в float64 (NaN для пустых и нечисловых)"""
+    import numpy as np
+    import pandas as pd
+    
+    return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+
+
+def _parse_template_columns(file_path, column_nmid, column_j, column_n):
+    """Разбирает шаблон в массив TEMPLATE_DTYPE (без заголовка)"""
+    import numpy as np
+    
+    raw_nmid, raw_j, raw_n = [], [], []
+    for nmid_value, value_j, value_n in iter_template_rows(file_path, (column_nmid, column_j, column_n)):
+        raw_nmid.append(nmid_value)
+        raw_j.append(value_j)
+        raw_n.append(value_n)
+    
+    columns = np.zeros(len(raw_nmid), dtype=TEMPLATE_DTYPE)
+    
+    # nmID: дробная часть отбрасывается, 0 - пустой или некорректный nmID
+    nmid = np.trunc(_numeric_column(raw_nmid))
+    valid_nmid = np.isfinite(nmid) & (np.abs(nmid) < 2.0 ** 63)
+    columns["nmid"] = np.where(valid_nmid, nmid, 0)
+    
+    # Нулевая цена в J равнозначна пустой ячейке
+    price = _numeric_column(raw_j)
+    columns["price"] = np.where(price == 0, np.nan, price)
+    columns["recommended"] = _numeric_column(raw_n)
+    columns["adjusted"] = adjust_template_columns(columns)
+    return columns
+
+
+def adjust_template_columns(columns):
+    """
+    Векторно вычисляет скорректированную цену: J = N - 1.
+    
+    Args:
+        columns: Массив TEMPLATE_DTYPE
+    
+    Returns:
+        Массив float64: N - 1, либо исходная J, если в N не число
+    """
+    import numpy as np
+    
+    recommended = columns["recommended"]
+    return np.where(np.isnan(recommended), columns["price"], recommended - 1)
+
+
+def template_price_map(columns, field="adjusted", rounding="round", positive_only=True):
+    """
+    Векторно формирует словарь цен {nmID: цена_в_рублях} из колонок шаблона.
+    
+    Строки без nmID или без цены (пусто, 0, не число) отбрасываются,
+    при повторах nmID остается значение из последней строки.
+    
+    Args:
+        columns: Массив TEMPLATE_DTYPE
+        field: Колонка с ценой ("adjusted", "price" или "recommended")
+        rounding: "round" - до ближайшего целого, "trunc" - отбросить дробную часть
+        positive_only: Оставлять только положительные nmID и цены
+    
+    Returns:
+        Dict[int, int]: Словарь {nmID: цена}
+    """
+    import numpy as np
+    
+    nmid = np.asarray(columns["nmid"])
+    values = np.asarray(columns[field])
+    
+    mask = (nmid != 0) & np.isfinite(values) & (values != 0)
+    nmid = nmid[mask]
+    values = np.rint(values[mask]) if rounding == "round" else np.trunc(values[mask])
+    
+    if positive_only:
+        positive = (nmid > 0) & (values > 0)
+        nmid = nmid[positive]
+        values = values[positive]
+    
+    # Последнее вхождение каждого nmID (как при последовательной записи в словарь)
+    _, last_reversed = np.unique(nmid[::-1], return_index=True)
+    keep = np.sort(len(nmid) - 1 - last_reversed)
+    return dict(zip(nmid[keep].tolist(), values[keep].astype(np.int64).tolist()))
+
+
+def load_template_columns(file_path, column_nmid=3, column_j=10, column_n=14, use_cache=True, sha256=None):
+    """
+    Возвращает колонки шаблона WB, используя кэш по хэшу содержимого.
+    
+    Разобранные колонки сохраняются в TEMPLATE_CACHE_DIR рядом с шаблоном
+    в бинарном формате .npy. Если файл не менялся, повторный вызов стоит
+    одного хэширования и отображения кэша в память (mmap) вместо разбора xlsx.
+    
+    Args:
+        file_path: Путь к Excel файлу
+        column_nmid: Номер колонки с nmID (по умолчанию 3, колонка C)
+        column_j: Номер колонки J (по умолчанию 10)
+        column_n: Номер колонки N (по умолчанию 14)
+        use_cache: Использовать и обновлять кэш
+        sha256: Уже вычисленный хэш содержимого (чтобы не читать файл повторно)
+    
+    Returns:
+        Массив numpy с полями nmid, price, recommended, adjusted (по строке на строку шаблона)
+    """
+    import numpy as np
+    
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Файл не найден: {file_path}")
+    
+    if not use_cache:
+        return _parse_template_columns(file_path, column_nmid, column_j, column_n)
+    
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), TEMPLATE_CACHE_DIR)
+    digest = sha256 or file_sha256(file_path)
+    cache_file = os.path.join(cache_dir, f"{digest}-{column_nmid}-{column_j}-{column_n}.npy")
+    
+    if os.path.exists(cache_file):
+        try:
+            # Время изменения - время последнего использования (для очистки кэша)
+            os.utime(cache_file)
+        except OSError:
+            pass
+        try:
+            return np.load(cache_file, mmap_mode="r")
+        except ValueError:
+            # Пустой массив нельзя отобразить в память
+            return np.load(cache_file)
+    
+    columns = _parse_template_columns(file_path, column_nmid, column_j, column_n)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".npy", dir=cache_dir)
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, columns)
+        os.replace(tmp_path, cache_file)
+        _prune_template_cache(cache_dir, keep=TEMPLATE_CACHE_KEEP)
+    except OSError:
+        # Кэш - только оптимизация, без него работаем как раньше
+        pass
+    return columns
+
+
+def _prune_template_cache(cache_dir, keep=TEMPLATE_CACHE_KEEP):
+    """
+    Удаляет из кэша шаблонов все записи, кроме keep последних использованных
+    (каждый новый шаблон добавляет запись со своим хэшем).
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".npy") and entry.is_file():
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                pass
+    entries.sort(reverse=True)
+    for _, path in entries[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            # Файл занят (например, отображен в память в Windows) - удалим в следующий раз
+            pass
+
+
+def template_needs_adjustment(file_path, sha256=None):
+    """
+    Проверяет, есть ли в шаблоне строки, где J еще не равна N - 1.
+    
+    Args:
+        file_path: Путь к Excel файлу
+        sha256: Уже вычисленный хэш содержимого
+    
+    Returns:
+        True, если adjust_prices() изменит хотя бы одну строку
+    """
+    import numpy as np
+    
+    columns = load_template_columns(file_path, sha256=sha256)
+    has_n = ~np.isnan(columns["recommended"])
+    return bool(np.any(columns["price"][has_n] != columns["adjusted"][has_n]))
+
+
+def template_manifest_path(file_path):
+    """Путь к манифесту директории, в которой лежит шаблон"""
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), TEMPLATE_MANIFEST_FILE)
+
+
+def load_template_manifest(manifest_path):
+    """
+    Читает манифест шаблонов.
+    
+    Returns:
+        Словарь {путь_без_ссылок (realpath): {"size", "mtime_ns", "sha256", "adjusted"}}
+    """
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_template_manifest(manifest_path, manifest):
+    """Атомарно сохраняет манифест, удаляя записи об уже удаленных файлах"""
+    manifest = {path: entry for path, entry in manifest.items() if os.path.exists(path)}
+    try:
+        fd, tmp_path = tempfile.mkstemp(suffix=".json", dir=os.path.dirname(manifest_path))
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+    except OSError:
+        # Манифест - только оптимизация
+        pass
+
+
+def _manifest_entry(file_path, sha256, adjusted):
+    """Запись манифеста для текущего состояния файла"""
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256, "adjusted": adjusted}
+
+
+def manifest_entry_is_current(file_path, entry):
+    """True, если размер и время изменения файла совпадают с записью манифеста (файл не открывается)"""
+    if not entry:
+        return False
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False
+    return entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns
+
+
+def verify_template(file_path, entry=None):
+    """
+    Быстрая проверка без записи: нужна ли шаблону корректировка J = N - 1.
+    
+    Проверки идут от дешевых к дорогим: размер и mtime из манифеста
+    (файл не открывается), затем хэш содержимого, и только для нового
+    содержимого - колонки шаблона (из кэша или разбором xlsx).
+    
+    Args:
+        file_path: Путь к Excel файлу
+        entry: Запись манифеста для этого файла (если есть)
+    
+    Returns:
+        Кортеж (needs_adjustment, entry): нужна ли корректировка и актуальная запись манифеста
+    """
+    if manifest_entry_is_current(file_path, entry):
+        return not entry["adjusted"], entry
+    
+    digest = file_sha256(file_path)
+    if entry and entry.get("sha256") == digest:
+        # Файл перезаписан без изменений (например, скопирован заново)
+        adjusted = entry["adjusted"]
+    else:
+        adjusted = not template_needs_adjustment(file_path, sha256=digest)
+    return not adjusted, _manifest_entry(file_path, digest, adjusted)
+
+
+def adjust_template_if_needed(file_path, entry=None):
+    """
+    Корректирует шаблон, только если J еще не равна N - 1.
+    
+    Уже скорректированный файл не перезаписывается, поэтому его mtime
+    не меняется и порядок в find_wb_template_files() остается стабильным.
+    
+    Args:
+        file_path: Путь к Excel файлу
+        entry: Запись манифеста для этого файла (если есть)
+    
+    Returns:
+        Кортеж (changes_count, entry): количество измененных строк (0, если файл
+        пропущен) и новая запись манифеста
+    """
+    needs_adjustment, entry = verify_template(file_path, entry)
+    if not needs_adjustment:
+        return 0, entry
+    
+    changes_count = adjust_prices(file_path, verbose=False)
+    return changes_count, _manifest_entry(file_path, file_sha256(file_path), True)
+
+
+def adjust_and_extract_prices(file_path, column_n=14, column_j=10, column_nmid=3):
+    """
+    Однопроходная корректировка: вычисляет J = N - 1 в памяти и сразу
+    возвращает цены для загрузки, не сохраняя и не перечитывая файл.
+    
+    Результат совпадает с последовательным вызовом adjust_prices()
+    и чтением колонки J: если в N не число, берется исходное значение J.
+    Разобранный шаблон берется из кэша, если файл не менялся.
+    
+    Args:
+        file_path: Путь к Excel файлу
+        column_n: Номер колонки N (по умолчанию 14)
+        column_j: Номер колонки J (по умолчанию 10)
+        column_nmid: Номер колонки с nmID (по умолчанию 3, колонка C)
+    
+    Returns:
+        Кортеж (prices, changes_count): словарь {nmID: цена_в_рублях}
+        и количество строк, в которых J = N - 1
+    """
+    import numpy as np
+    
+    columns = load_template_columns(file_path, column_nmid, column_j, column_n)
+    
+    # WB API работает с ценами в рублях (int), округляем до целого
+    prices = template_price_map(columns, "adjusted", rounding="round")
+    changes_count = int(np.count_nonzero(~np.isnan(columns["recommended"])))
+    return prices, changes_count
+
+
+def adjust_template_with_manifest(file_path):
+    """
+    Корректирует шаблон с учетом манифеста его директории и обновляет манифест.
+    
+    Returns:
+        Количество измененных строк (0, если файл уже скорректирован)
+    """
+    manifest_path = template_manifest_path(file_path)
+    manifest = load_template_manifest(manifest_path)
+    key = os.path.realpath(file_path)
+    changes_count, manifest[key] = adjust_template_if_needed(file_path, manifest.get(key))
+    save_template_manifest(manifest_path, manifest)
+    return changes_count
+
+
 def find_wb_template_files(directory="."):
     """
     Находит файлы шаблонов WB по паттерну имени
@@ -96,10 +902,20 @@ def find_wb_template_files(directory="."):
 
 
 def main():
-    """Основная функция для запуска скрипта из командной строки"""
-    if len(sys.argv) > 1:
+    """
+    Основная функция для запуска скрипта из командной строки.
+    
+    С флагом --verify файл не изменяется: выводится, нужна ли корректировка
+    (код возврата 2, если нужна). С флагом --import-time в конце выводится
+    время импорта модулей.
+    """
+    args = sys.argv[1:]
+    verify_only = "--verify" in args
+    args = [arg for arg in args if arg not in ("--verify", "--import-time")]
+    
+    if args:
         # Если передан путь к файлу как аргумент
-        file_path = sys.argv[1]
+        file_path = args[0]
         if not os.path.exists(file_path):
             print(f"Ошибка: Файл не найден: {file_path}")
             sys.exit(1)
@@ -108,16 +924,37 @@ def main():
         found_files = find_wb_template_files()
         if not found_files:
             print("Ошибка: Не найден файл шаблона WB.")
-            print("Использование: python update_prices.py [путь_к_файлу.xlsx]")
+            print("Использование: python update_prices.py [--verify] [--import-time] [путь_к_файлу.xlsx]")
             sys.exit(1)
         
         # Берем самый новый файл
         file_path = found_files[0]
         print(f"Найден файл: {file_path}")
     
+    manifest_path = template_manifest_path(file_path)
+    manifest = load_template_manifest(manifest_path)
+    key = os.path.realpath(file_path)
+    
     try:
+        if verify_only:
+            needs_adjustment, manifest[key] = verify_template(file_path, manifest.get(key))
+            save_template_manifest(manifest_path, manifest)
+            if needs_adjustment:
+                print(f"Требуется корректировка: {file_path}")
+                sys.exit(2)
+            print(f"Корректировка не требуется: {file_path}")
+            return
+        
         print(f"Обработка файла: {file_path}")
+        needs_adjustment, manifest[key] = verify_template(file_path, manifest.get(key))
+        if not needs_adjustment:
+            save_template_manifest(manifest_path, manifest)
+            print("\nГотово! Файл уже скорректирован, изменений не требуется.")
+            return
+        
         changes_count = adjust_prices(file_path, verbose=True)
+        manifest[key] = _manifest_entry(file_path, file_sha256(file_path), True)
+        save_template_manifest(manifest_path, manifest)
         print(f"\nГотово! Изменено {changes_count} строк.")
     except Exception as e:
         print(f"Ошибка при обработке файла: {e}")
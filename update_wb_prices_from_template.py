@@ -9,11 +9,21 @@
 
 import os
 import sys
-import time
+
+if "--import-time" in sys.argv:
+    # Отчет о времени импорта печатается при завершении скрипта
+    from import_timing import enable_import_timing
+    enable_import_timing()
+
+from importlib.util import find_spec
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
 
+from wb_http import get_session
+from wb_upload import AdaptiveBatchSize, REJECT_STATUS_CODES, reject_batch, upload_batches, write_rejects
+
 # Загружаем переменные окружения
 load_dotenv()
 load_dotenv('.env')
@@ -22,25 +32,19 @@ load_dotenv('.env')
 sys.path.insert(0, str(Path(__file__).parent))
 
 # Импортируем функции из других модулей
+# (test_download_excel с selenium импортируется в шаге 1, requests и openpyxl -
+# в тех функциях, где они используются)
 try:
-    # Временно подавляем выполнение test_download_excel.py при импорте
-    import test_download_excel
-    download_excel_only = test_download_excel.download_excel_only
-except ImportError:
-    print("[ERROR] Не удалось импортировать download_excel_only из test_download_excel.py")
-    sys.exit(1)
-
-try:
-    from update_prices import adjust_prices, find_wb_template_files
+    from update_prices import (
+        adjust_and_extract_prices, adjust_template_with_manifest, find_wb_template_files,
+        load_template_columns, template_price_map,
+    )
 except ImportError:
     print("[ERROR] Не удалось импортировать adjust_prices из update_prices.py")
     sys.exit(1)
 
-try:
-    import requests
-    import openpyxl
-    from openpyxl import load_workbook
-except ImportError:
+# Проверяем наличие библиотек, не загружая их
+if find_spec("requests") is None or find_spec("openpyxl") is None:
     print("[ERROR] Необходимые библиотеки не установлены")
     print("Установите: py -m pip install requests openpyxl")
     sys.exit(1)
@@ -58,6 +62,23 @@ class Config:
     # Директория для работы
     TARGET_DIR: Path = Path(os.getenv('TARGET_DIR', str(Path.cwd())))
     
+    # Сохранять скорректированный шаблон (J = N - 1) на диск.
+    # Цены для API берутся из памяти, запись выполняется в фоне параллельно с загрузкой
+    SAVE_ADJUSTED_TEMPLATE: bool = os.getenv('SAVE_ADJUSTED_TEMPLATE', 'true').lower() == 'true'
+    
+    # Количество батчей цен, отправляемых одновременно (не больше WB_HTTP_POOL_SIZE)
+    PRICES_CONCURRENCY: int = int(os.getenv('PRICES_CONCURRENCY', '2'))
+    
+    # Размер батча (0 - подбирается автоматически в пределах лимита API в 1000 товаров)
+    UPLOAD_BATCH_SIZE: int = int(os.getenv('UPLOAD_BATCH_SIZE', '0'))
+    UPLOAD_MAX_BATCH_SIZE: int = int(os.getenv('UPLOAD_MAX_BATCH_SIZE', '1000'))
+    UPLOAD_TARGET_LATENCY: float = float(os.getenv('UPLOAD_TARGET_LATENCY', '5'))
+    
+    # Файл для товаров, отклоненных WB (с текстом ошибки сервера), и предел таких
+    # товаров за загрузку, после которого батчи больше не делятся в поисках ошибочных
+    REJECTS_FILE: Path = Path(os.getenv('REJECTS_FILE', str(Path.cwd() / "wb_rejects.csv")))
+    UPLOAD_MAX_REJECTS: int = int(os.getenv('UPLOAD_MAX_REJECTS', '100'))
+    
     @classmethod
     def validate(cls) -> None:
         """Проверяет, что все необходимые переменные окружения установлены"""
@@ -96,9 +117,6 @@ def read_prices_from_excel_template(template_file: str) -> Dict[int, int]:
     print(f"[INFO] Читаю цены из файла: {os.path.basename(template_file)}")
     
     try:
-        wb = load_workbook(template_file, data_only=True)
-        ws = wb.active
-        
         # Колонки в шаблоне WB:
         # Колонка C (3) - nmID
         # Колонка J (10) - цена (скорректированная)
@@ -106,32 +124,13 @@ def read_prices_from_excel_template(template_file: str) -> Dict[int, int]:
         nmid_col = 3  # Колонка C
         price_col = 10  # Колонка J
         
-        # Читаем данные начиная со второй строки (первая - заголовок)
-        read_count = 0
-        for row in range(2, ws.max_row + 1):
-            try:
-                nmid_cell = ws.cell(row=row, column=nmid_col)
-                price_cell = ws.cell(row=row, column=price_col)
-                
-                # Пропускаем пустые строки
-                if not nmid_cell.value or not price_cell.value:
-                    continue
-                
-                try:
-                    nmid = int(float(str(nmid_cell.value)))
-                    price = float(str(price_cell.value))
-                    
-                    # WB API работает с ценами в рублях (int), не в копейках
-                    # Округляем до целого числа рублей
-                    price_rubles = int(round(price))
-                    
-                    if nmid > 0 and price_rubles > 0:
-                        prices[nmid] = price_rubles
-                        read_count += 1
-                except (ValueError, TypeError):
-                    continue
-            except Exception:
-                continue
+        # Колонки шаблона (из кэша, если файл не менялся)
+        columns = load_template_columns(template_file, column_nmid=nmid_col, column_j=price_col)
+        
+        # WB API работает с ценами в рублях (int), не в копейках
+        # Округляем до целого числа рублей
+        prices = template_price_map(columns, "price", rounding="round")
+        read_count = len(prices)
         
         print(f"[OK] Прочитано цен: {read_count}")
         return prices
@@ -154,8 +153,11 @@ def update_prices_via_api(prices_data: List[Dict[str, Any]]) -> bool:
     Returns:
         bool: True если успешно
     """
+    import requests
+    
     url = f"{Config.PRICES_API_URL}/upload/task"
-    headers = get_headers()
+    # Общая сессия (см. wb_http): соединение переиспользуется между запросами
+    session = get_session(get_headers)
     
     # Удаляем дубликаты nmID - оставляем последнее значение для каждого nmID
     seen_nmids = {}
@@ -181,14 +183,8 @@ def update_prices_via_api(prices_data: List[Dict[str, Any]]) -> bool:
     payload = {"data": data_items}
     
     try:
-        # API требует POST
-        response = requests.post(url, headers=headers, json=payload, timeout=120)
-        
-        # Обрабатываем 429 ошибку (Too Many Requests)
-        if response.status_code == 429:
-            print("[WARN] Превышен лимит запросов (429), ожидание 5 секунд...")
-            time.sleep(5)
-            response = requests.post(url, headers=headers, json=payload, timeout=120)
+        # API требует POST. Лимит запросов и повтор после 429 - в общей сессии (wb_http)
+        response = session.post(url, json=payload, timeout=120)
         
         # Обрабатываем 400 ошибки - некоторые не критичны
         if response.status_code == 400:
@@ -227,16 +223,20 @@ def update_prices_via_api(prices_data: List[Dict[str, Any]]) -> bool:
         print(f"[ERROR] Ошибка при обновлении цен: {e}")
         if hasattr(e, 'response') and e.response is not None:
             print(f"Ответ сервера: {e.response.text}")
+            if e.response.status_code in REJECT_STATUS_CODES:
+                # Ошибка в данных (например, неверный nmID или цена) - батч будет разделен
+                reject_batch(e.response.text)
         return False
 
 
-def update_prices_in_batches(prices_dict: Dict[int, int], batch_size: int = 100) -> bool:
+def update_prices_in_batches(prices_dict: Dict[int, int], batch_size: Optional[int] = None) -> bool:
     """
     Обновляет цены на WB через API, разбивая на батчи
     
     Args:
         prices_dict: Словарь {nmID: price_in_rubles}
-        batch_size: Размер батча (по умолчанию 100)
+        batch_size: Размер батча (по умолчанию Config.UPLOAD_BATCH_SIZE;
+            0 - размер подбирается по скорости ответов и ошибкам)
         
     Returns:
         bool: True если все батчи обработаны успешно
@@ -255,29 +255,32 @@ def update_prices_in_batches(prices_dict: Dict[int, int], batch_size: int = 100)
         })
     
     total_items = len(prices_data)
-    total_batches = (total_items + batch_size - 1) // batch_size
+    batch_size = Config.UPLOAD_BATCH_SIZE if batch_size is None else batch_size
+    if batch_size > 0:
+        batch_info = f"{(total_items + batch_size - 1) // batch_size} батчей"
+    else:
+        batch_size = AdaptiveBatchSize(Config.UPLOAD_MAX_BATCH_SIZE, target_latency=Config.UPLOAD_TARGET_LATENCY)
+        batch_info = "размер батча подбирается автоматически"
     
-    print(f"[INFO] Обновление цен через API: {total_items} товаров, {total_batches} батчей")
+    print(f"[INFO] Обновление цен через API: {total_items} товаров, {batch_info} "
+          f"(одновременно до {Config.PRICES_CONCURRENCY})")
     
-    all_success = True
+    results = upload_batches("Цены", prices_data, update_prices_via_api,
+                             batch_size=batch_size, concurrency=Config.PRICES_CONCURRENCY,
+                             max_rejects=Config.UPLOAD_MAX_REJECTS)
     
-    for i in range(0, total_items, batch_size):
-        batch = prices_data[i:i + batch_size]
-        batch_num = i // batch_size + 1
-        
-        print(f"[INFO] Обработка батча {batch_num}/{total_batches} ({len(batch)} товаров)...")
-        
-        success = update_prices_via_api(batch)
-        
-        if not success:
-            all_success = False
-            print(f"[WARN] Батч {batch_num} завершился с ошибкой")
-        
-        # Задержка между батчами для избежания 429 ошибок
-        if i + batch_size < total_items:
-            time.sleep(0.5)
+    for result in results:
+        if not result.ok:
+            print(f"[WARN] Батч {result.number} завершился с ошибкой")
     
-    return all_success
+    # Остальные товары отклоненных батчей загружены, ошибочные - в файле для разбора
+    rejected_count = sum(len(result.rejected) for result in results)
+    if rejected_count:
+        written = write_rejects(Config.REJECTS_FILE, "Цены", results)
+        details = f"подробности в {Config.REJECTS_FILE}" if written else "файл отклоненных товаров не записан"
+        print(f"[WARN] WB отклонил товаров: {rejected_count}, {details}")
+    
+    return all(result.ok for result in results)
 
 
 def main():
@@ -297,6 +300,12 @@ def main():
     print("[ШАГ 1] Скачивание актуального Excel шаблона с рекомендуемыми ценами...")
     print("-" * 70)
     
+    try:
+        from test_download_excel import download_excel_only
+    except ImportError:
+        print("[ERROR] Не удалось импортировать download_excel_only из test_download_excel.py")
+        sys.exit(1)
+    
     try:
         template_file = download_excel_only()
     except Exception as e:
@@ -332,12 +341,12 @@ def main():
     print(f"[OK] Шаблон скачан: {os.path.basename(template_file)}")
     print()
     
-    # Шаг 2: Корректируем цены (J = N - 1)
+    # Шаг 2: Корректируем цены (J = N - 1) и сразу получаем их в памяти
     print("[ШАГ 2] Корректировка цен в шаблоне (колонка J = N - 1)...")
     print("-" * 70)
     
     try:
-        changes_count = adjust_prices(template_file, verbose=False)
+        prices_dict, changes_count = adjust_and_extract_prices(template_file)
         print(f"[OK] Скорректировано цен: {changes_count}")
     except Exception as e:
         print(f"[ERROR] Ошибка при корректировке цен: {e}")
@@ -347,13 +356,10 @@ def main():
     
     print()
     
-    # Шаг 3: Читаем цены из колонки J и загружаем на WB через API
+    # Шаг 3: Загружаем скорректированные цены на WB через API
     print("[ШАГ 3] Загрузка скорректированных цен на WB через API...")
     print("-" * 70)
     
-    # Читаем цены из колонки J
-    prices_dict = read_prices_from_excel_template(template_file)
-    
     if not prices_dict:
         print("[ERROR] Не удалось прочитать цены из шаблона")
         return
@@ -361,8 +367,24 @@ def main():
     print(f"[INFO] Прочитано цен для обновления: {len(prices_dict)}")
     print()
     
+    # Сохранение скорректированного файла не нужно для загрузки - выполняем его в фоне
+    save_executor = None
+    save_future = None
+    if Config.SAVE_ADJUSTED_TEMPLATE:
+        save_executor = ThreadPoolExecutor(max_workers=1)
+        save_future = save_executor.submit(adjust_template_with_manifest, template_file)
+    
     # Обновляем цены через API батчами
-    success = update_prices_in_batches(prices_dict, batch_size=100)
+    success = update_prices_in_batches(prices_dict)
+    
+    if save_future is not None:
+        try:
+            save_future.result()
+            print(f"[OK] Скорректированный шаблон сохранен: {os.path.basename(template_file)}")
+        except Exception as e:
+            print(f"[WARN] Не удалось сохранить скорректированный шаблон: {e}")
+        finally:
+            save_executor.shutdown()
     
     if success:
         print()
@@ -11,68 +11,39 @@
 """
 
 import os
+import sys
+
+if "--import-time" in sys.argv:
+    # Отчет о времени импорта печатается при завершении скрипта
+    from import_timing import enable_import_timing
+    enable_import_timing()
+
 import requests
-import pandas as pd
 from dotenv import load_dotenv
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple
-import csv
+from typing import List, Dict, Any, Optional, Tuple, Set
+import json
 import re
 import time
 from datetime import datetime
-import glob
-import shutil
-
-# Импортируем функцию корректировки цен из update_prices.py
-try:
-    from update_prices import adjust_prices, find_wb_template_files
-except ImportError:
-    # Если модуль не найден, определяем функцию здесь
-    import openpyxl
-    from openpyxl import load_workbook
-    
-    def adjust_prices(file_path, column_n=14, column_j=10, verbose=False):
-        """Корректирует цены в Excel файле: устанавливает колонку J = N - 1"""
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"Файл не найден: {file_path}")
-        
-        wb = load_workbook(file_path)
-        ws = wb.active
-        max_row = ws.max_row
-        changes_count = 0
-        
-        for row in range(1, max_row + 1):
-            cell_n = ws.cell(row=row, column=column_n)
-            cell_j = ws.cell(row=row, column=column_j)
-            
-            if cell_n.value is not None:
-                try:
-                    value_n = float(cell_n.value)
-                    new_value_j = value_n - 1
-                    cell_j.value = new_value_j
-                    changes_count += 1
-                    if verbose:
-                        print(f"Строка {row}: N={value_n} -> J={new_value_j}")
-                except (ValueError, TypeError):
-                    if verbose:
-                        print(f"Строка {row}: значение в N не является числом, пропускаем")
-        
-        wb.save(file_path)
-        return changes_count
-    
-    def find_wb_template_files(directory="."):
-        """Находит файлы шаблонов WB по паттерну имени"""
-        patterns = [
-            "Шаблон обновления цен и скидок*.xlsx",
-            "*обновления цен*.xlsx",
-            "*WB*.xlsx",
-        ]
-        found_files = []
-        for pattern in patterns:
-            found_files.extend(glob.glob(os.path.join(directory, pattern)))
-        found_files = list(set(found_files))
-        found_files.sort(key=lambda x: os.path.getmtime(x), reverse=True)
-        return found_files
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+from wb_brands import BrandSource, ingest_brands, write_json_atomic
+from wb_catalog import read_mapping_files
+from wb_http import get_session, idempotent_requests
+from wb_upload import (AdaptiveBatchSize, REJECT_STATUS_CODES, reject_batch, run_uploads,
+                       upload_batches_async, write_rejects)
+
+# pandas, numpy, openpyxl и selenium импортируются внутри функций тех этапов,
+# которым они нужны, чтобы не замедлять запуск скрипта (например, из cron)
+
+# Корректировка и чтение шаблонов WB - из update_prices.py
+from update_prices import (
+    find_wb_template_files, load_template_columns, template_price_map,
+    adjust_template_if_needed, manifest_entry_is_current,
+    template_manifest_path, load_template_manifest, save_template_manifest,
+)
 
 # Загружаем переменные окружения
 # Пробуем загрузить из текущей директории и из родительской
@@ -103,9 +74,49 @@ class Config:
     # Коэффициент повышения цены
     PRICE_MULTIPLIER: float = 1.5
     
+    # Правила цен по брендам (JSON), например {"BOSCH": {"multiplier": 1.6, "min_ratio": 0.85}}
+    # Поля: multiplier, use_recommended, recommended_offset, min_ratio, round_to (см. PriceRules)
+    BRAND_PRICE_RULES: str = os.getenv('BRAND_PRICE_RULES', '')
+    
     # Автоматическая корректировка цен (J = N - 1) для избежания непривлекательных цен
     AUTO_ADJUST_PRICES: bool = os.getenv('AUTO_ADJUST_PRICES', 'true').lower() == 'true'
     
+    # Загружать только изменения с прошлой успешной загрузки (по снимкам брендов)
+    DELTA_UPLOAD: bool = os.getenv('DELTA_UPLOAD', 'true').lower() == 'true'
+    SNAPSHOT_DIR: Path = Path(os.getenv('SNAPSHOT_DIR', str(Path.cwd() / ".brand_snapshots")))
+    
+    # Размер блока товаров при сопоставлении файла бренда с "Баркоды.xlsx"
+    BRAND_CHUNK_SIZE: int = int(os.getenv('BRAND_CHUNK_SIZE', '50000'))
+    
+    # Файлы брендов от этого размера (МБ) разбираются блоками в нескольких процессах (0 - никогда)
+    BRAND_CHUNKED_PARSE_MB: int = int(os.getenv('BRAND_CHUNKED_PARSE_MB', '256'))
+    # Размер блока (МБ) и количество процессов (0 - по числу ядер) для такого разбора
+    BRAND_PARSE_CHUNK_MB: int = int(os.getenv('BRAND_PARSE_CHUNK_MB', '64'))
+    PARSE_WORKERS: int = int(os.getenv('PARSE_WORKERS', '0'))
+    
+    # Кэш нормализованных файлов брендов (колонки .npy, читаются через mmap)
+    BRAND_CACHE: bool = os.getenv('BRAND_CACHE', 'true').lower() == 'true'
+    BRAND_CACHE_DIR: Path = Path(os.getenv('BRAND_CACHE_DIR', str(Path.cwd() / ".brand_cache")))
+    
+    # Количество процессов для чтения файлов брендов (0 - по числу ядер)
+    BRAND_WORKERS: int = int(os.getenv('BRAND_WORKERS', '0'))
+    
+    # Размер батча (0 - подбирается автоматически в пределах лимита API в 1000 товаров)
+    # и количество батчей, отправляемых одновременно (не больше WB_HTTP_POOL_SIZE)
+    UPLOAD_BATCH_SIZE: int = int(os.getenv('UPLOAD_BATCH_SIZE', '0'))
+    UPLOAD_MAX_BATCH_SIZE: int = int(os.getenv('UPLOAD_MAX_BATCH_SIZE', '1000'))
+    UPLOAD_TARGET_LATENCY: float = float(os.getenv('UPLOAD_TARGET_LATENCY', '5'))
+    
+    # Файл для товаров, отклоненных WB (с текстом ошибки сервера), и предел таких
+    # товаров за загрузку, после которого батчи больше не делятся в поисках ошибочных
+    REJECTS_FILE: Path = Path(os.getenv('REJECTS_FILE', str(Path.cwd() / "wb_rejects.csv")))
+    UPLOAD_MAX_REJECTS: int = int(os.getenv('UPLOAD_MAX_REJECTS', '100'))
+    STOCKS_CONCURRENCY: int = int(os.getenv('STOCKS_CONCURRENCY', '4'))
+    PRICES_CONCURRENCY: int = int(os.getenv('PRICES_CONCURRENCY', '2'))
+    
+    # Количество процессов для корректировки шаблонов (0 - по числу ядер)
+    ADJUST_WORKERS: int = int(os.getenv('ADJUST_WORKERS', '0'))
+    
     # Автоматическая загрузка Excel шаблона через браузер (требует Selenium)
     AUTO_DOWNLOAD_EXCEL: bool = os.getenv('AUTO_DOWNLOAD_EXCEL', 'true').lower() == 'true'  # По умолчанию включено для теста
     
@@ -127,6 +138,9 @@ class Config:
     # Путь для сохранения cookies (для автоматической авторизации)
     COOKIES_FILE: Path = Path.cwd() / "wb_cookies.pkl"
     
+    # Постоянный индекс соответствий из "Баркоды.xlsx" (перестраивается при изменении файла)
+    SKU_INDEX_FILE: Path = Path(os.getenv('SKU_INDEX_FILE', str(Path.cwd() / ".barcodes_index.sqlite")))
+    
     @classmethod
     def validate(cls) -> None:
         """Проверяет, что все необходимые переменные окружения установлены"""
@@ -166,12 +180,19 @@ def get_headers() -> Dict[str, str]:
     }
 
 
+def get_wb_session() -> requests.Session:
+    """
+    Общая сессия для всех запросов к API WB (см. wb_http): соединения
+    переиспользуются между батчами, токен читается один раз за запуск.
+    """
+    return get_session(get_headers)
+
+
 def get_warehouses() -> List[Dict[str, Any]]:
     """Получить список складов продавца"""
     url = f"{Config.STOCKS_API_URL}/warehouses"
-    headers = get_headers()
     
-    response = requests.get(url, headers=headers)
+    response = get_wb_session().get(url)
     response.raise_for_status()
     
     warehouses = response.json()
@@ -182,99 +203,6 @@ def get_warehouses() -> List[Dict[str, Any]]:
     return warehouses
 
 
-def read_mapping_files() -> Tuple[Dict[str, str], Dict[str, str], Dict[str, str], Dict[str, str], Dict[str, str]]:
-    """
-    Читает файл соответствия "Баркоды.xlsx"
-    
-    Структура файла (данные с 5-й строки):
-    - Колонка B (индекс 1) - артикул производителя
-    - Колонка C (индекс 2) - nmID (артикул WB)
-    - Колонка G (индекс 6) - баркод
-    
-    Returns:
-        Tuple[Dict[str, str], Dict[str, str], Dict[str, str], Dict[str, str], Dict[str, str]]: 
-            - Словарь {артикул_производителя: nmID}
-            - Словарь {баркод: nmID}
-            - Словарь {артикул_производителя: nmID} (дубликат для совместимости)
-            - Словарь {артикул_производителя: баркод}
-            - Словарь {баркод: chrtId} (пустой, заполняется позже)
-    """
-    art_to_nmid: Dict[str, str] = {}  # Артикул производителя -> nmID
-    barcode_to_nmid: Dict[str, str] = {}  # Баркод -> nmID
-    manufacturer_art_to_nmid: Dict[str, str] = {}  # Артикул производителя -> nmID (дубликат)
-    manufacturer_art_to_barcode: Dict[str, str] = {}  # Артикул производителя -> баркод
-    barcode_to_chrtid: Dict[str, str] = {}
-    
-    # Ищем файл с баркодами
-    barcode_file = None
-    for file in os.listdir('.'):
-        if 'Баркоды' in file and file.endswith('.xlsx'):
-            barcode_file = file
-            break
-    
-    if barcode_file:
-        try:
-            # Читаем файл, пропуская первые 4 строки (данные начинаются с 5-й строки)
-            df_barcode = pd.read_excel(barcode_file, header=0, skiprows=4)
-            
-            # Структура файла (данные с 5-й строки):
-            # Колонка B (индекс 1) - артикул производителя
-            # Колонка C (индекс 2) - nmID (артикул WB)
-            # Колонка G (индекс 6) - баркод
-            if len(df_barcode.columns) >= 7:
-                manufacturer_art_col = df_barcode.columns[1]  # Колонка B - артикул производителя
-                nmid_col = df_barcode.columns[2]  # Колонка C - nmID
-                barcode_col = df_barcode.columns[6]  # Колонка G - баркод
-                
-                for idx, row in df_barcode.iterrows():
-                    try:
-                        manufacturer_art = str(row[manufacturer_art_col]).strip() if len(row) > 1 else None
-                        nmid_val = row[nmid_col]
-                        barcode = str(row[barcode_col]).strip()
-                        
-                        # Пропускаем заголовки и пустые значения
-                        if manufacturer_art.lower() in ['артикул', 'артикул производителя', 'nan', ''] or not manufacturer_art:
-                            continue
-                        
-                        if pd.isna(nmid_val) or not barcode or barcode.lower() in ['баркод', 'barcode', 'баркод в системе', 'nan', ''] or len(barcode) <= 5:
-                            continue
-                        
-                        # Получаем nmID из колонки C
-                        try:
-                            nmid = str(int(float(nmid_val))).strip()
-                        except (ValueError, TypeError):
-                            continue
-                        
-                        if nmid and barcode:
-                            # Создаем соответствие артикул производителя -> nmID
-                            # Сохраняем все варианты: оригинальный, без пробелов, нормализованный
-                            manufacturer_art_clean = manufacturer_art.replace(' ', '').upper()
-                            manufacturer_art_normalized = manufacturer_art_clean.replace('-', '').replace('/', '').replace('_', '')
-                            
-                            art_to_nmid[manufacturer_art] = nmid  # Оригинальный вариант
-                            art_to_nmid[manufacturer_art_clean] = nmid  # Без пробелов
-                            art_to_nmid[manufacturer_art_normalized] = nmid  # Нормализованный
-                            manufacturer_art_to_nmid[manufacturer_art_clean] = nmid
-                            
-                            # Создаем соответствие баркод -> nmID
-                            barcode_to_nmid[barcode] = nmid
-                            
-                            # Создаем соответствие артикул производителя -> баркод
-                            manufacturer_art_to_barcode[manufacturer_art] = barcode  # Оригинальный вариант
-                            manufacturer_art_to_barcode[manufacturer_art_clean] = barcode  # Без пробелов
-                            manufacturer_art_to_barcode[manufacturer_art_normalized] = barcode  # Нормализованный
-                    except (ValueError, TypeError, KeyError, IndexError):
-                        continue
-        except Exception as e:
-            print(f"Ошибка при чтении файла баркодов: {e}")
-            import traceback
-            traceback.print_exc()
-    else:
-        print("[WARN] Файл 'Баркоды.xlsx' не найден!")
-    
-    return art_to_nmid, barcode_to_nmid, manufacturer_art_to_nmid, manufacturer_art_to_barcode, barcode_to_chrtid
-
-
 def get_chrt_id_by_barcode(barcode: str, warehouse_id: int, stocks_cache: Optional[Dict[str, int]] = None) -> Optional[int]:
     """
     Получить chrtId по баркоду через API или из кэша
@@ -313,130 +241,130 @@ def get_all_stocks(warehouse_id: int) -> Dict[str, int]:
     return {}
 
 
-def read_brand_file(brand: str) -> List[Dict[str, Any]]:
+def brand_source() -> BrandSource:
+    """Каталоги файлов брендов и настройки их чтения из Config (см. wb_brands)"""
+    # Сначала ищем в BASE_DIR (для сервера: ~/wildberries/price), затем в TARGET_DIR
+    directories = [Config.TARGET_DIR]
+    if Config.BASE_DIR and Path(Config.BASE_DIR).exists():
+        directories.insert(0, Path(Config.BASE_DIR))
+    return BrandSource(
+        directories,
+        chunk_size=Config.BRAND_CHUNK_SIZE,
+        cache_dir=Config.BRAND_CACHE_DIR if Config.BRAND_CACHE else None,
+        chunked_parse_mb=Config.BRAND_CHUNKED_PARSE_MB,
+        parse_chunk_mb=Config.BRAND_PARSE_CHUNK_MB,
+        parse_workers=Config.PARSE_WORKERS,
+    )
+
+
+# Колонки, по которым вычисляется хэш строки в снимке бренда
+SNAPSHOT_COLUMNS = ['nmID', 'price', 'sku', 'amount']
+
+
+def brand_snapshot_path(brand: str) -> Path:
+    """Путь к снимку последней успешной загрузки бренда"""
+    return Config.SNAPSHOT_DIR / f"brand_{brand}.json"
+
+
+def load_brand_snapshot(brand: str) -> Dict[str, List[Any]]:
     """
-    Читает файл бренда и извлекает данные
+    Читает снимок бренда.
     
-    Args:
-        brand: Название бренда
-        
     Returns:
-        List[Dict[str, Any]]: Список товаров с данными
+        Dict[str, List[Any]]: {артикул: [хэш_строки, баркод]} (пустой, если снимка нет)
     """
-    # Сначала ищем в BASE_DIR (для сервера: ~/wildberries/price)
-    # Если не найдено, ищем в TARGET_DIR
-    if Config.BASE_DIR and Path(Config.BASE_DIR).exists():
-        brand_file = Path(Config.BASE_DIR) / f"brand_{brand}.csv"
-        if not brand_file.exists():
-            # Пробуем в TARGET_DIR
-            brand_file = Config.TARGET_DIR / f"brand_{brand}.csv"
-    else:
-        brand_file = Config.TARGET_DIR / f"brand_{brand}.csv"
+    try:
+        with open(brand_snapshot_path(brand), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_brand_snapshot(brand: str, snapshot: Dict[str, List[Any]]) -> None:
+    """Атомарно сохраняет снимок бренда"""
+    snapshot_path = brand_snapshot_path(brand)
+    try:
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(snapshot_path, snapshot)
+    except OSError as e:
+        print(f"  [WARN] Не удалось сохранить снимок {snapshot_path}: {e}")
+
+
+def brand_delta(matched: 'pd.DataFrame', unmatched: List[str],
+                snapshot: Dict[str, List[Any]]) -> Tuple['pd.DataFrame', List[str], Dict[str, List[Any]]]:
+    """
+    Сравнивает товары бренда со снимком прошлой успешной загрузки.
     
-    if not brand_file.exists():
-        print(f"  [WARN] Файл не найден: {brand_file}")
-        return []
+    Хэш строки считается по итоговым данным для загрузки (nmID, цена после
+    корректировки, баркод, количество), поэтому изменение рекомендуемой цены
+    тоже попадает в изменения.
     
-    print(f"  [INFO] Читаю файл: {brand_file}")
+    Args:
+        matched: Товары из price_matched_products() (с итоговыми ценами)
+        unmatched: Артикулы бренда, которых нет в файле соответствия
+        snapshot: Снимок из load_brand_snapshot()
     
-    products = []
+    Returns:
+        Tuple[pd.DataFrame, List[str], Dict[str, List[Any]]]:
+            - Новые и измененные строки (по последней строке на артикул)
+            - Баркоды товаров, которые пропали из файла бренда (остаток обнуляется)
+            - Новый снимок бренда
+    """
+    import pandas as pd
+    
+    current = matched.drop_duplicates('article', keep='last')
+    hashes = pd.util.hash_pandas_object(current[SNAPSHOT_COLUMNS], index=False).tolist()
+    articles = current['article'].tolist()
+    skus = current['sku'].tolist()
+    
+    changed = [snapshot.get(article, (None,))[0] != row_hash for article, row_hash in zip(articles, hashes)]
+    
+    # Пропавшие артикулы: нет в файле бренда совсем (артикулы без соответствия
+    # не считаются пропавшими - например, если не прочитан "Баркоды.xlsx")
+    present = set(articles)
+    present.update(unmatched)
+    current_skus = set(skus)
+    removed = list(dict.fromkeys(
+        sku for article, (_, sku) in snapshot.items()
+        if article not in present and sku and sku not in current_skus
+    ))
+    
+    new_snapshot = {article: [row_hash, sku] for article, row_hash, sku in zip(articles, hashes, skus)}
+    return current[changed], removed, new_snapshot
+
+
+def forget_rejected(snapshot: Dict[str, List[Any]], previous: Dict[str, List[Any]], changed: 'pd.DataFrame',
+                    rejected_nmids: Set[int], rejected_skus: Set[str]) -> int:
+    """
+    Исправляет новый снимок бренда так, чтобы отклоненные WB товары были
+    отправлены снова при следующем запуске.
     
-    # Определяем кодировку и разделитель
-    encoding = 'utf-8'
-    try:
-        with open(brand_file, 'r', encoding='utf-8') as f:
-            sample = f.read(1000)
-    except UnicodeDecodeError:
-        encoding = 'cp1251'
-        with open(brand_file, 'r', encoding='cp1251') as f:
-            sample = f.read(1000)
-    
-    # Определяем разделитель
-    sniffer = csv.Sniffer()
-    try:
-        dialect = sniffer.sniff(sample, delimiters=',;\t')
-    except:
-        dialect = csv.excel
+    Отклоненные новые и измененные артикулы убираются из снимка. Пропавшие
+    артикулы, обнуление остатка которых отклонено, возвращаются в снимок из
+    предыдущего - и снова попадут в пропавшие.
     
-    # Читаем файл
-    with open(brand_file, 'r', encoding=encoding) as f:
-        reader = csv.reader(f, dialect=dialect)
-        
-        header = None
-        for row_num, row in enumerate(reader):
-            if row_num == 0:
-                header = row
-                continue
-            
-            if len(row) < 5:
-                continue
-            
-            # Структура файла бренда:
-            # Колонка A (0) - бренд
-            # Колонка B (1) - возможно артикул продавца или название
-            # Колонка C (2) - возможно баркод или другой идентификатор
-            # Колонка D (3) - цена
-            # Колонка E (4) - количество
-            
-            try:
-                # Извлекаем цену из колонки D (индекс 3)
-                price_str = str(row[3]).strip().replace(',', '.').replace(' ', '').replace('"', '')
-                # Извлекаем количество из колонки E (индекс 4)
-                amount_str = str(row[4]).strip().replace(',', '.').replace(' ', '').replace('"', '')
-                
-                price = None
-                amount = None
-                
-                if price_str and price_str.lower() not in ['nan', '', 'цена', 'price']:
-                    try:
-                        price = float(price_str)
-                    except ValueError:
-                        pass
-                
-                if amount_str and amount_str.lower() not in ['nan', '', 'количество', 'amount', 'остаток']:
-                    try:
-                        amount = int(float(amount_str))
-                    except ValueError:
-                        pass
-                
-                if price is None or amount is None:
-                    continue
-                
-                # Ищем артикул производителя и баркод
-                # В CSV файлах колонка B (индекс 1) содержит артикул производителя (F00BH40270, AG 01007, CUK18000-2)
-                # Колонка C (индекс 2) содержит описание товара
-                manufacturer_art = None  # Артикул производителя из CSV
-                seller_art = None  # Артикул продавца (будет найден через соответствие)
-                barcode = None
-                
-                # Колонка B (индекс 1) - это артикул производителя
-                if len(row) > 1 and row[1]:
-                    potential_manufacturer_art = str(row[1]).strip().replace('"', '').replace("'", '')
-                    # Пропускаем заголовки
-                    if (potential_manufacturer_art.lower() not in ['бренд', 'brand', 'артикул', 'артикул продавца', 'название', 'name', 'nan', '', 'none'] and
-                        len(potential_manufacturer_art) >= 2 and len(potential_manufacturer_art) <= 20):
-                        # Убираем пробелы для сопоставления (AG 01007 -> AG01007)
-                        manufacturer_art = potential_manufacturer_art.replace(' ', '')
-                
-                # Проверяем колонку C (индекс 2) на наличие баркода (маловероятно, но проверим)
-                if len(row) > 2 and row[2]:
-                    potential_barcode = str(row[2]).strip().replace('"', '').replace("'", '').replace(' ', '').replace('-', '')
-                    # Если это длинный баркод (13+ цифр) - EAN-13
-                    if len(potential_barcode) >= 13 and potential_barcode.isdigit():
-                        barcode = potential_barcode
-                
-                products.append({
-                    'manufacturer_art': manufacturer_art,  # Артикул производителя из CSV
-                    'seller_art': seller_art,  # Артикул продавца (будет найден через соответствие)
-                    'barcode': barcode,
-                    'price': price,
-                    'amount': amount,
-                    'row': row
-                })
-            except (ValueError, IndexError, TypeError) as e:
-                continue
+    Args:
+        snapshot: Новый снимок из brand_delta()
+        previous: Снимок, с которым сравнивал brand_delta()
+        changed: Отправленные строки бренда из brand_delta()
+        rejected_nmids: nmID отклоненных цен
+        rejected_skus: Баркоды отклоненных остатков
     
-    return products
+    Returns:
+        int: Количество исправленных артикулов
+    """
+    forgotten = 0
+    if len(changed) > 0:
+        is_rejected = changed['nmID'].astype('int64').isin(rejected_nmids) | changed['sku'].isin(rejected_skus)
+        for article in changed.loc[is_rejected, 'article']:
+            if snapshot.pop(article, None) is not None:
+                forgotten += 1
+    
+    for article, entry in previous.items():
+        if article not in snapshot and entry[1] in rejected_skus:
+            snapshot[article] = entry
+            forgotten += 1
+    return forgotten
 
 
 def update_stocks(warehouse_id: int, stocks_data: List[Dict[str, Any]]) -> bool:
@@ -451,19 +379,13 @@ def update_stocks(warehouse_id: int, stocks_data: List[Dict[str, Any]]) -> bool:
         bool: True если успешно
     """
     url = f"{Config.STOCKS_API_URL}/stocks/{warehouse_id}"
-    headers = get_headers()
+    session = get_wb_session()
     
     payload = {"stocks": stocks_data}
     
     try:
-        response = requests.put(url, headers=headers, json=payload, timeout=60)
-        
-        # Обрабатываем 429 ошибку (Too Many Requests)
-        if response.status_code == 429:
-            print(f"    [WARN] Превышен лимит запросов (429), ожидание 5 секунд...")
-            time.sleep(5)
-            # Повторяем запрос после задержки
-            response = requests.put(url, headers=headers, json=payload, timeout=60)
+        # Лимит запросов и повтор после 429 - в общей сессии (wb_http)
+        response = session.put(url, json=payload, timeout=60)
         
         response.raise_for_status()
         return True
@@ -471,6 +393,9 @@ def update_stocks(warehouse_id: int, stocks_data: List[Dict[str, Any]]) -> bool:
         print(f"    [ERROR] Ошибка при обновлении остатков: {e}")
         if hasattr(e, 'response') and e.response is not None:
             print(f"    Ответ сервера: {e.response.text}")
+            if e.response.status_code in REJECT_STATUS_CODES:
+                # Ошибка в данных - батч будет разделен, чтобы найти ошибочные товары
+                reject_batch(e.response.text)
         return False
 
 
@@ -490,7 +415,7 @@ def get_recommended_prices(nmids: List[int]) -> Dict[int, Optional[int]]:
         return recommended_prices
     
     print(f"  [INFO] Получение рекомендуемых цен для {len(nmids)} товаров...")
-    headers = get_headers()
+    session = get_wb_session()
     
     # Разбиваем на батчи по 100 nmID (лимит API)
     batch_size = 100
@@ -507,7 +432,7 @@ def get_recommended_prices(nmids: List[int]) -> Dict[int, Optional[int]]:
             url = f"{Config.PRICES_API_URL}/info"
             params = {"nmIDs": ",".join(map(str, batch_nmids))}
             
-            response = requests.get(url, headers=headers, params=params, timeout=10)
+            response = session.get(url, params=params, timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -542,7 +467,9 @@ def get_recommended_prices(nmids: List[int]) -> Dict[int, Optional[int]]:
                 url = f"{Config.PRICES_API_URL}/list/goods/filter"
                 payload = {"nmIDs": batch_nmids}
                 
-                response = requests.post(url, headers=headers, json=payload, timeout=10)
+                # POST только читает данные - повтор после таймаута безопасен
+                with idempotent_requests():
+                    response = session.post(url, json=payload, timeout=10)
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -569,36 +496,172 @@ def get_recommended_prices(nmids: List[int]) -> Dict[int, Optional[int]]:
                                     pass
             except (requests.exceptions.RequestException, KeyError, ValueError):
                 pass
-        
-        # Небольшая задержка между батчами
-        if i + batch_size < len(nmids):
-            time.sleep(0.5)
     
     return recommended_prices
 
 
-def adjust_price_by_recommended(nmid: int, current_price: int, recommended_prices: Dict[int, Optional[int]]) -> int:
+class PriceRules:
     """
-    Корректирует цену: если есть рекомендуемая цена, устанавливает на 1 меньше.
-    Иначе возвращает текущую цену.
+    Правила расчета цены бренда.
+    
+    Базовая цена - цена поставщика * multiplier (дробная часть отбрасывается).
+    Если есть рекомендуемая цена WB и use_recommended, цена = рекомендуемая -
+    recommended_offset, но не меньше base_price * min_ratio (дробная часть
+    отбрасывается). При round_to > 1 цены округляются вниз до кратных round_to.
+    """
+    
+    __slots__ = ('multiplier', 'use_recommended', 'recommended_offset', 'min_ratio', 'round_to')
+    
+    def __init__(self, multiplier: Optional[float] = None, use_recommended: bool = True,
+                 recommended_offset: int = 1, min_ratio: float = 0.9, round_to: int = 1):
+        self.multiplier = Config.PRICE_MULTIPLIER if multiplier is None else float(multiplier)
+        self.use_recommended = bool(use_recommended)
+        self.recommended_offset = int(recommended_offset)
+        self.min_ratio = float(min_ratio)
+        self.round_to = max(int(round_to), 1)
+    
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"PriceRules({fields})"
+
+
+def price_rules_for(brand: str) -> PriceRules:
+    """
+    Правила цен бренда из Config.BRAND_PRICE_RULES (общие, если для бренда ничего не задано).
     
     Args:
-        nmid: nmID товара
-        current_price: Текущая цена из прайса
-        recommended_prices: Словарь рекомендуемых цен {nmID: price}
+        brand: Название бренда
+    
+    Returns:
+        PriceRules: Правила цен
+    """
+    if not Config.BRAND_PRICE_RULES:
+        return PriceRules()
+    try:
+        overrides = json.loads(Config.BRAND_PRICE_RULES).get(brand) or {}
+        return PriceRules(**overrides)
+    except (ValueError, TypeError, AttributeError) as e:
+        print(f"  [WARN] Некорректные правила цен BRAND_PRICE_RULES для {brand}: {e}. Используются общие")
+        return PriceRules()
+
+
+def _round_prices(prices: 'np.ndarray', rules: PriceRules) -> 'np.ndarray':
+    """Округляет цены вниз до кратных rules.round_to"""
+    if rules.round_to > 1:
+        return prices // rules.round_to * rules.round_to
+    return prices
+
+
+def compute_base_prices(supplier_prices: 'np.ndarray', rules: PriceRules) -> 'np.ndarray':
+    """
+    Базовые цены из цен поставщика (массив float64, все значения конечные).
+    
+    Returns:
+        np.ndarray: Цены int64 (как int(price * multiplier) для каждого товара)
+    """
+    import numpy as np
+    return _round_prices(np.trunc(supplier_prices * rules.multiplier).astype(np.int64), rules)
+
+
+def compute_prices(base_prices: 'np.ndarray', recommended: 'np.ndarray', has_recommended: 'np.ndarray',
+                   rules: PriceRules) -> 'np.ndarray':
+    """
+    Итоговые цены по базовым и рекомендуемым ценам.
+    
+    Args:
+        base_prices: Базовые цены (int64)
+        recommended: Рекомендуемые цены (int64, значение не важно, где has_recommended = False)
+        has_recommended: Есть ли рекомендуемая цена
+        rules: Правила цен бренда
+    
+    Returns:
+        np.ndarray: Цены int64
+    """
+    import numpy as np
+    
+    base_prices = np.asarray(base_prices, dtype=np.int64)
+    if not rules.use_recommended:
+        return base_prices.copy()
+    
+    # Не меньше min_ratio от базовой цены (защита от слишком низких цен)
+    min_prices = np.trunc(base_prices * rules.min_ratio).astype(np.int64)
+    adjusted = _round_prices(np.maximum(recommended - rules.recommended_offset, min_prices), rules)
+    return np.where(has_recommended, adjusted, base_prices)
+
+
+def price_matched_products(matched: 'pd.DataFrame', rules: PriceRules) -> 'pd.DataFrame':
+    """
+    Базовые цены товаров бренда, сопоставленных с каталогом (см. wb_brands.match_brand_products).
+    
+    Returns:
+        pd.DataFrame: Колонки nmID, price, base_price, discount (данные для цен),
+        sku, amount (данные для остатков) и article (артикул из файла бренда)
+    """
+    import numpy as np
+    import pandas as pd
+    
+    base_price = compute_base_prices(matched['supplier_price'].to_numpy(dtype=np.float64), rules)
+    return pd.DataFrame({
+        'nmID': matched['nmID'].to_numpy(),
+        'price': base_price,  # Временно сохраняем базовую цену, скорректируем позже
+        'base_price': base_price,  # Сохраняем для корректировки
+        'discount': np.zeros(len(base_price), dtype=np.int64),
+        'sku': matched['sku'].to_numpy(),
+        'amount': matched['amount'].to_numpy(),
+        'article': matched['article'].to_numpy(),
+    })
+
+
+def recommended_price_arrays(nmids: Any, recommended_prices: Dict[int, Optional[int]]) -> Tuple['np.ndarray', 'np.ndarray']:
+    """
+    Рекомендуемые цены для массива nmID.
     
     Returns:
-        int: Скорректированная цена
+        Tuple[np.ndarray, np.ndarray]: Цены int64 (0, где цены нет) и маска наличия цены
     """
-    if nmid in recommended_prices and recommended_prices[nmid] is not None:
-        recommended_price = recommended_prices[nmid]
-        # Устанавливаем цену на 1 меньше рекомендуемой
-        adjusted_price = recommended_price - 1
-        # Но не меньше текущей цены * 0.9 (защита от слишком низких цен)
-        min_price = int(current_price * 0.9)
-        return max(adjusted_price, min_price)
+    import numpy as np
+    import pandas as pd
+    
+    known = {nmid: price for nmid, price in recommended_prices.items() if price is not None}
+    if not known:
+        count = len(nmids)
+        return np.zeros(count, dtype=np.int64), np.zeros(count, dtype=bool)
+    
+    # Соединение через хэш-индекс pandas (как сопоставление артикулов с каталогом)
+    index = pd.Index(list(known.keys()))
+    values = np.fromiter(known.values(), dtype=np.int64, count=len(known))
+    found_at = index.get_indexer(np.asarray(nmids))
+    has_recommended = found_at >= 0
+    return np.where(has_recommended, values[found_at], 0), has_recommended
+
+
+def apply_recommended_prices(matched: 'pd.DataFrame', recommended_prices: Dict[int, Optional[int]],
+                             rules: Optional[PriceRules] = None) -> int:
+    """
+    Векторно корректирует колонку price по рекомендуемым ценам (см. compute_prices):
+    цена на 1 меньше рекомендуемой, но не меньше 90% базовой цены.
     
-    return current_price
+    Args:
+        matched: Товары из price_matched_products() (изменяется на месте)
+        recommended_prices: Словарь рекомендуемых цен {nmID: price}
+        rules: Правила цен бренда (по умолчанию - общие)
+    
+    Returns:
+        int: Количество товаров, цена которых отличается от базовой
+    """
+    import numpy as np
+    
+    rules = rules or PriceRules()
+    if not rules.use_recommended:
+        return 0
+    
+    recommended, has_recommended = recommended_price_arrays(matched['nmID'].to_numpy(), recommended_prices)
+    base_price = matched['base_price'].to_numpy()
+    price = compute_prices(base_price, recommended, has_recommended, rules)
+    # Без рекомендуемой цены колонка price не меняется
+    price = np.where(has_recommended, price, matched['price'].to_numpy()).astype(np.int64)
+    matched['price'] = price
+    return int(np.count_nonzero(has_recommended & (price != base_price)))
 
 
 def update_prices(prices_data: List[Dict[str, Any]]) -> bool:
@@ -612,7 +675,7 @@ def update_prices(prices_data: List[Dict[str, Any]]) -> bool:
         bool: True если успешно
     """
     url = f"{Config.PRICES_API_URL}/upload/task"
-    headers = get_headers()
+    session = get_wb_session()
     
     # Формируем данные в правильном формате (как в update_prices_stocks_wb.py)
     # Удаляем дубликаты nmID - оставляем последнее значение для каждого nmID
@@ -640,15 +703,8 @@ def update_prices(prices_data: List[Dict[str, Any]]) -> bool:
     payload = {"data": data_items}
     
     try:
-        # API требует POST, а не PUT
-        response = requests.post(url, headers=headers, json=payload, timeout=120)
-        
-        # Обрабатываем 429 ошибку (Too Many Requests)
-        if response.status_code == 429:
-            print(f"    [WARN] Превышен лимит запросов (429), ожидание 5 секунд...")
-            time.sleep(5)
-            # Повторяем запрос после задержки
-            response = requests.post(url, headers=headers, json=payload, timeout=120)
+        # API требует POST, а не PUT. Лимит запросов и повтор после 429 - в общей сессии (wb_http)
+        response = session.post(url, json=payload, timeout=120)
         
         # Обрабатываем 400 ошибки - некоторые не критичны
         if response.status_code == 400:
@@ -657,7 +713,7 @@ def update_prices(prices_data: List[Dict[str, Any]]) -> bool:
                 error_text = error_data.get('errorText', '')
                 error_lower = error_text.lower()
                 
-                if 'already set' in error_lower or 'уже установлены' in error_lower():
+                if 'already set' in error_lower or 'уже установлены' in error_lower:
                     # Цены уже установлены - это нормально, не считаем ошибкой
                     print(f"    [INFO] Цены уже установлены (не требуют обновления)")
                     return True
@@ -689,6 +745,9 @@ def update_prices(prices_data: List[Dict[str, Any]]) -> bool:
         print(f"    [ERROR] Ошибка при обновлении цен: {e}")
         if hasattr(e, 'response') and e.response is not None:
             print(f"    Ответ сервера: {e.response.text}")
+            if e.response.status_code in REJECT_STATUS_CODES:
+                # Ошибка в данных (например, неверный nmID или цена) - батч будет разделен
+                reject_batch(e.response.text)
         return False
 
 
@@ -712,36 +771,16 @@ def read_prices_from_excel_template() -> Dict[int, int]:
     print(f"  [INFO] Читаю рекомендуемые цены из: {os.path.basename(template_file)}")
     
     try:
-        import openpyxl
-        from openpyxl import load_workbook
-        
-        wb = load_workbook(template_file, data_only=True)  # data_only=True для получения значений формул
-        ws = wb.active
-        
         # Ищем колонки:
         # Колонка C (3) - nmID
         # Колонка N (14) - рекомендуемая цена
-        # Колонка J (10) - текущая цена (может быть скорректирована)
         
-        header_row = 1
         nmid_col = 3  # Колонка C
         recommended_price_col = 14  # Колонка N
         
-        # Читаем данные начиная со второй строки
-        for row in range(2, ws.max_row + 1):
-            try:
-                nmid_cell = ws.cell(row=row, column=nmid_col)
-                price_cell = ws.cell(row=row, column=recommended_price_col)
-                
-                if nmid_cell.value and price_cell.value:
-                    try:
-                        nmid = int(float(str(nmid_cell.value)))
-                        recommended_price = int(float(str(price_cell.value)))
-                        recommended_prices[nmid] = recommended_price
-                    except (ValueError, TypeError):
-                        continue
-            except Exception:
-                continue
+        # Колонки шаблона берутся из кэша, если файл не менялся с прошлого запуска
+        columns = load_template_columns(template_file, column_nmid=nmid_col, column_n=recommended_price_col)
+        recommended_prices = template_price_map(columns, "recommended", rounding="trunc", positive_only=False)
         
         print(f"  [OK] Прочитано рекомендуемых цен: {len(recommended_prices)}")
         return recommended_prices
@@ -853,6 +892,9 @@ def download_excel_via_api() -> Optional[str]:
     """
     print("[INFO] Попытка загрузки Excel шаблона через API...")
     
+    # Адреса ниже - догадки, а не документированные методы API: пробуем их
+    # обычными запросами без повторов и без учета в circuit breaker общей сессии.
+    # Токен API отправляем только на хост API цен, не на seller.wildberries.ru
     headers = get_headers()
     download_dir = str(Config.TARGET_DIR)
     os.makedirs(download_dir, exist_ok=True)
@@ -868,32 +910,33 @@ def download_excel_via_api() -> Optional[str]:
     for endpoint in api_endpoints:
         try:
             print(f"  [INFO] Пробую endpoint: {endpoint}")
-            response = requests.get(endpoint, headers=headers, timeout=5, stream=True)  # Уменьшил таймаут до 5 сек
-            
-            if response.status_code == 200:
-                # Проверяем, что это Excel файл
-                content_type = response.headers.get('Content-Type', '')
-                content_disposition = response.headers.get('Content-Disposition', '')
-                
-                if 'excel' in content_type.lower() or 'spreadsheet' in content_type.lower() or '.xlsx' in content_disposition.lower():
-                    # Генерируем имя файла
-                    filename = "Шаблон обновления цен и скидок.xlsx"
-                    if content_disposition:
-                        # Пытаемся извлечь имя файла из заголовка
-                        import re
-                        match = re.search(r'filename[^;=\n]*=(([\'"]).*?\2|[^;\n]*)', content_disposition)
-                        if match:
-                            filename = match.group(1).strip('"\'')
-                    
-                    file_path = Path(download_dir) / filename
-                    
-                    # Сохраняем файл
-                    with open(file_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
+            endpoint_headers = headers if endpoint.startswith(Config.PRICES_API_URL) else None
+            # Непрочитанный ответ (stream=True) закрываем, чтобы вернуть соединение
+            with requests.get(endpoint, headers=endpoint_headers, timeout=5, stream=True) as response:  # Уменьшил таймаут до 5 сек
+                if response.status_code == 200:
+                    # Проверяем, что это Excel файл
+                    content_type = response.headers.get('Content-Type', '')
+                    content_disposition = response.headers.get('Content-Disposition', '')
                     
-                    print(f"  [OK] Файл скачан через API: {filename}")
-                    return str(file_path)
+                    if 'excel' in content_type.lower() or 'spreadsheet' in content_type.lower() or '.xlsx' in content_disposition.lower():
+                        # Генерируем имя файла
+                        filename = "Шаблон обновления цен и скидок.xlsx"
+                        if content_disposition:
+                            # Пытаемся извлечь имя файла из заголовка
+                            import re
+                            match = re.search(r'filename[^;=\n]*=(([\'"]).*?\2|[^;\n]*)', content_disposition)
+                            if match:
+                                filename = match.group(1).strip('"\'')
+                        
+                        file_path = Path(download_dir) / filename
+                        
+                        # Сохраняем файл
+                        with open(file_path, 'wb') as f:
+                            for chunk in response.iter_content(chunk_size=8192):
+                                f.write(chunk)
+                        
+                        print(f"  [OK] Файл скачан через API: {filename}")
+                        return str(file_path)
         except requests.exceptions.RequestException as e:
             continue
     
@@ -1457,36 +1500,133 @@ def download_excel_template_automated() -> Optional[str]:
     return None
 
 
+def _adjust_template_file(file_path: str, entry: Optional[Dict[str, Any]]) -> Tuple[int, float, Optional[Dict[str, Any]]]:
+    """
+    Корректирует один файл шаблона (выполняется в отдельном процессе).
+    
+    Returns:
+        Tuple[int, float, Optional[Dict[str, Any]]]: Количество скорректированных цен,
+            время обработки в секундах и новая запись манифеста
+    """
+    started = time.perf_counter()
+    # Шаблон, где J уже равна N - 1, не переписываем
+    changes_count, entry = adjust_template_if_needed(file_path, entry)
+    return changes_count, time.perf_counter() - started, entry
+
+
+def find_unique_template_files(search_dirs: List[str]) -> List[str]:
+    """
+    Собирает файлы шаблонов WB из нескольких директорий без повторов.
+    
+    Директории часто пересекаются (cwd, BASE_DIR, TARGET_DIR), поэтому файлы
+    сравниваются по абсолютному пути и по inode (жесткие и символические ссылки).
+    
+    Args:
+        search_dirs: Директории для поиска
+        
+    Returns:
+        List[str]: Уникальные файлы шаблонов
+    """
+    unique_files = []
+    seen_paths = set()
+    seen_inodes = set()
+    
+    for search_dir in search_dirs:
+        for file_path in find_wb_template_files(search_dir):
+            resolved = os.path.realpath(file_path)
+            try:
+                stat = os.stat(resolved)
+            except OSError:
+                continue
+            inode = (stat.st_dev, stat.st_ino)
+            if resolved in seen_paths or inode in seen_inodes:
+                continue
+            seen_paths.add(resolved)
+            seen_inodes.add(inode)
+            unique_files.append(resolved)
+    
+    return unique_files
+
+
 def auto_adjust_wb_template_prices() -> None:
     """
     Автоматически корректирует цены в Excel файлах шаблонов WB.
     Находит все файлы шаблонов и устанавливает J = N - 1 для избежания
     "непривлекательных цен" на Wildberries.
+    
+    Каждый файл обрабатывается один раз, разные файлы - параллельно в пуле процессов.
     """
     print("[INFO] Поиск Excel файлов шаблонов WB для автоматической корректировки цен...")
     
     # Ищем в текущей директории и в BASE_DIR
     search_dirs = [os.getcwd()]
-    if hasattr(Config, 'BASE_DIR') and Config.BASE_DIR.exists():
+    if Config.BASE_DIR and Config.BASE_DIR.exists():
         search_dirs.append(str(Config.BASE_DIR))
-    if hasattr(Config, 'TARGET_DIR') and Config.TARGET_DIR.exists():
+    if Config.TARGET_DIR and Config.TARGET_DIR.exists():
         search_dirs.append(str(Config.TARGET_DIR))
     
+    found_files = find_unique_template_files(search_dirs)
+    
+    # Манифесты директорий: уже скорректированные и не менявшиеся файлы пропускаем, не открывая
+    manifests: Dict[str, Dict[str, Any]] = {}
+    pending_files = []
+    for file_path in found_files:
+        manifest_path = template_manifest_path(file_path)
+        if manifest_path not in manifests:
+            manifests[manifest_path] = load_template_manifest(manifest_path)
+        entry = manifests[manifest_path].get(file_path)
+        if manifest_entry_is_current(file_path, entry) and entry.get("adjusted"):
+            print(f"  [INFO] {os.path.basename(file_path)}: уже скорректирован (по манифесту)")
+            continue
+        pending_files.append((file_path, manifest_path, entry))
+    
     total_adjusted = 0
-    for search_dir in search_dirs:
-        found_files = find_wb_template_files(search_dir)
+    if pending_files:
+        print(f"  [INFO] Файлов для проверки: {len(pending_files)} из {len(found_files)}")
+        started = time.perf_counter()
         
-        for file_path in found_files:
-            try:
-                print(f"  [INFO] Обработка: {os.path.basename(file_path)}")
-                changes_count = adjust_prices(file_path, verbose=False)
+        workers = Config.ADJUST_WORKERS or os.cpu_count() or 1
+        workers = min(workers, len(pending_files))
+        
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            futures = {
+                executor.submit(_adjust_template_file, file_path, entry): (file_path, manifest_path)
+                for file_path, manifest_path, entry in pending_files
+            }
+            completed = (futures[future] + (future.result,) for future in as_completed(futures))
+        else:
+            # Один файл - без накладных расходов на запуск процессов
+            completed = (
+                (file_path, manifest_path, partial(_adjust_template_file, file_path, entry))
+                for file_path, manifest_path, entry in pending_files
+            )
+        
+        try:
+            for file_path, manifest_path, get_result in completed:
+                try:
+                    changes_count, elapsed, entry = get_result()
+                except Exception as e:
+                    print(f"  [ERROR] {os.path.basename(file_path)}: ошибка при обработке файла: {e}")
+                    continue
+                
+                if entry is not None:
+                    manifests[manifest_path][file_path] = entry
                 if changes_count > 0:
-                    print(f"    [OK] Скорректировано {changes_count} цен")
+                    print(f"  [OK] {os.path.basename(file_path)}: скорректировано {changes_count} цен ({elapsed:.2f} сек)")
                     total_adjusted += changes_count
                 else:
-                    print(f"    [INFO] Изменений не требуется")
-            except Exception as e:
-                print(f"    [ERROR] Ошибка при обработке файла: {e}")
+                    print(f"  [INFO] {os.path.basename(file_path)}: изменений не требуется ({elapsed:.2f} сек)")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        
+        print(f"  [INFO] Обработано файлов: {len(pending_files)} за {time.perf_counter() - started:.2f} сек")
+    
+    for manifest_path, manifest in manifests.items():
+        if manifest_path is not None:
+            save_template_manifest(manifest_path, manifest)
     
     if total_adjusted > 0:
         print(f"[OK] Автоматическая корректировка завершена. Всего скорректировано цен: {total_adjusted}\n")
@@ -1515,108 +1655,41 @@ def main() -> None:
     
     # Читаем файлы соответствия
     print(f"\n[INFO] Ищу файлы в директории: {Config.TARGET_DIR}")
-    art_to_nmid, barcode_to_nmid, manufacturer_art_to_nmid, manufacturer_art_to_barcode, barcode_to_chrtid = read_mapping_files()
+    catalog = read_mapping_files(Config.SKU_INDEX_FILE)
     
-    if not art_to_nmid and not barcode_to_nmid:
+    if not catalog:
         print("[WARN] Предупреждение: не найдено файлов соответствия")
     else:
-        print(f"[INFO] Загружено соответствий: артикулов={len(art_to_nmid)}, баркодов={len(barcode_to_nmid)}")
+        print(f"[INFO] Загружено соответствий: артикулов={len(catalog)}, баркодов={catalog.barcode_count()}")
     
     # Обрабатываем каждый бренд
     print(f"\n[INFO] Обработка брендов: {Config.BRANDS}")
     
-    all_stocks_data: Dict[int, List[Dict[str, Any]]] = {}  # {warehouse_id: [stocks]}
-    all_prices_data: List[Dict[str, Any]] = []
+    # {бренд: (найденные товары, артикулы без соответствия)}
+    brand_results: Dict[str, Tuple['pd.DataFrame', List[str]]] = {}
     
-    for brand in Config.BRANDS:
+    # Файлы брендов читаются и сопоставляются с файлом "Баркоды.xlsx" параллельно.
+    # Товары, артикула которых нет в файле соответствия, пропускаем
+    # (это означает, что карточка еще не создана на WB)
+    for brand, get_result in ingest_brands(Config.BRANDS, catalog, brand_source(), workers=Config.BRAND_WORKERS):
         print(f"\n[INFO] Обработка бренда: {brand}")
-        products = read_brand_file(brand)
-        print(f"  [INFO] Загружено товаров из файла: {len(products)}")
+        try:
+            matched, unmatched, products_count, elapsed = get_result()
+        except Exception as e:
+            print(f"  [ERROR] Ошибка при обработке бренда {brand}: {e}")
+            continue
+        print(f"  [INFO] Загружено товаров из файла: {products_count} ({elapsed:.2f} сек)")
         
-        if not products:
+        if not products_count:
             continue
         
-        matched_count = 0
-        processed_count = 0
+        matched = price_matched_products(matched, price_rules_for(brand))
+        matched_count = len(matched)
+        brand_results[brand] = (matched, unmatched)
         
-        for product in products:
-            processed_count += 1
-            if processed_count % 100 == 0:
-                print(f"  [INFO] Обработано товаров: {processed_count}/{len(products)}")
-            nmid = None
-            
-            # Проверяем только артикулы, которые есть в файле "Баркоды.xlsx"
-            # Если артикула нет в файле соответствия, пропускаем товар
-            if not product.get('manufacturer_art'):
-                continue
-            
-            manufacturer_art = str(product['manufacturer_art']).strip()
-            manufacturer_art_clean = manufacturer_art.replace(' ', '').upper()
-            manufacturer_art_normalized = manufacturer_art_clean.replace('-', '').replace('/', '').replace('_', '')
-            
-            # Проверяем, есть ли артикул в файле соответствия
-            art_found = False
-            if manufacturer_art in art_to_nmid:
-                nmid = art_to_nmid[manufacturer_art]
-                art_found = True
-            elif manufacturer_art_clean in art_to_nmid:
-                nmid = art_to_nmid[manufacturer_art_clean]
-                art_found = True
-            else:
-                # Пробуем найти с учетом нормализации (убираем дефисы, слэши и т.д.)
-                for art_key, art_nmid in art_to_nmid.items():
-                    art_key_normalized = str(art_key).strip().replace(' ', '').upper().replace('-', '').replace('/', '').replace('_', '')
-                    if art_key_normalized == manufacturer_art_normalized:
-                        nmid = art_nmid
-                        art_found = True
-                        break
-            
-            # Если артикул не найден в файле соответствия, пропускаем товар
-            # (это означает, что карточка еще не создана на WB)
-            if not art_found:
-                continue
-            
-            matched_count += 1
-            
-            # Подготавливаем данные для обновления цен
-            # Сохраняем исходную цену для дальнейшей корректировки
-            base_price = int(product['price'] * Config.PRICE_MULTIPLIER)
-            all_prices_data.append({
-                "nmID": int(nmid),
-                "price": base_price,  # Временно сохраняем базовую цену, скорректируем позже
-                "base_price": base_price,  # Сохраняем для корректировки
-                "discount": 0
-            })
-            
-            # Подготавливаем данные для обновления остатков
-            # Обновляем остатки только на складе 1619436
-            TARGET_WAREHOUSE_ID = 1619436
-            
-            if TARGET_WAREHOUSE_ID not in all_stocks_data:
-                all_stocks_data[TARGET_WAREHOUSE_ID] = []
-            
-            # Получаем баркод для обновления остатков из файла соответствия (колонка G)
-            # Баркод всегда берем из файла "Баркоды.xlsx", так как артикул уже проверен
-            barcode_for_stock = None
-            if manufacturer_art in manufacturer_art_to_barcode:
-                barcode_for_stock = manufacturer_art_to_barcode[manufacturer_art]
-            elif manufacturer_art_clean in manufacturer_art_to_barcode:
-                barcode_for_stock = manufacturer_art_to_barcode[manufacturer_art_clean]
-            else:
-                # Пробуем нормализованный вариант
-                for art_key, barcode_val in manufacturer_art_to_barcode.items():
-                    art_key_normalized = str(art_key).strip().replace(' ', '').upper().replace('-', '').replace('/', '').replace('_', '')
-                    if art_key_normalized == manufacturer_art_normalized:
-                        barcode_for_stock = barcode_val
-                        break
-            
-            if barcode_for_stock:
-                # Используем только sku - API сам найдет chrtId по sku при обновлении остатков
-                # Это соответствует логике из update_prices_stocks_wb.py
-                all_stocks_data[TARGET_WAREHOUSE_ID].append({
-                    "sku": barcode_for_stock,
-                    "amount": product['amount']
-                })
+        if unmatched:
+            examples = ', '.join(unmatched[:10])
+            print(f"  [INFO] Нет в файле соответствия: {len(unmatched)} артикулов (например: {examples})")
         
         if matched_count > 0:
             print(f"  {brand}: обработано {matched_count} товаров")
@@ -1628,13 +1701,15 @@ def main() -> None:
         if downloaded_file:
             print(f"  [OK] Свежий шаблон скачан: {os.path.basename(downloaded_file)}")
     
-    if not all_stocks_data and not all_prices_data:
+    has_matches = any(len(matched) for matched, _ in brand_results.values())
+    # В режиме DELTA_UPLOAD товары могли пропасть из файлов - тогда обнуляем их остатки
+    if not has_matches and not (Config.DELTA_UPLOAD and brand_results):
         print("\n[WARN] Не найдено данных для обновления")
         return
     
     # Автоматическая корректировка цен через Excel шаблон WB
     # Примечание: API WB не предоставляет рекомендуемые цены, поэтому используем Excel файл
-    if all_prices_data and Config.AUTO_ADJUST_PRICES:
+    if has_matches and Config.AUTO_ADJUST_PRICES:
         print("\n[INFO] Автоматическая корректировка цен через Excel шаблон WB...")
         
         # Пытаемся автоматически скачать свежий Excel шаблон (если включено)
@@ -1650,82 +1725,130 @@ def main() -> None:
         
         if recommended_prices:
             print(f"  [INFO] Применяю корректировку цен на основе Excel шаблона...")
-            adjusted_count = 0
-            
-            for item in all_prices_data:
-                nmid = item["nmID"]
-                base_price = item.get("base_price", item["price"])
-                
-                if nmid in recommended_prices:
-                    # Устанавливаем цену на 1 меньше рекомендуемой
-                    recommended_price = recommended_prices[nmid]
-                    adjusted_price = recommended_price - 1
-                    # Защита от слишком низких цен
-                    min_price = int(base_price * 0.9)
-                    adjusted_price = max(adjusted_price, min_price)
-                    
-                    item["price"] = adjusted_price
-                    if adjusted_price != base_price:
-                        adjusted_count += 1
+            # Цена на 1 меньше рекомендуемой, но не меньше 90% базовой
+            adjusted_count = sum(
+                apply_recommended_prices(matched, recommended_prices, price_rules_for(brand))
+                for brand, (matched, _) in brand_results.items()
+            )
             
             if adjusted_count > 0:
                 print(f"  [OK] Скорректировано цен: {adjusted_count} (на 1 меньше рекомендуемой из Excel)")
         else:
             print("  [WARN] Рекомендуемые цены не прочитаны из Excel, используем базовые цены")
-    elif all_prices_data and not Config.AUTO_ADJUST_PRICES:
+    elif has_matches and not Config.AUTO_ADJUST_PRICES:
         print("\n[INFO] Автоматическая корректировка цен отключена (AUTO_ADJUST_PRICES=false)")
     
+    # Загружаем только изменения с прошлой успешной загрузки
+    upload_frames = [matched for matched, _ in brand_results.values()]
+    removed_skus: List[str] = []
+    new_snapshots: Dict[str, Dict[str, List[Any]]] = {}
+    old_snapshots: Dict[str, Dict[str, List[Any]]] = {}
+    if Config.DELTA_UPLOAD:
+        print("\n[INFO] Сравнение с прошлой успешной загрузкой...")
+        upload_frames = []
+        for brand, (matched, unmatched) in brand_results.items():
+            old_snapshots[brand] = load_brand_snapshot(brand)
+            changed, removed, new_snapshots[brand] = brand_delta(matched, unmatched, old_snapshots[brand])
+            upload_frames.append(changed)
+            removed_skus.extend(removed)
+            unchanged_count = len(new_snapshots[brand]) - len(changed)
+            print(f"  {brand}: новых и измененных {len(changed)}, пропавших {len(removed)}, без изменений {unchanged_count}")
+    
+    all_stocks_data: Dict[int, List[Dict[str, Any]]] = {}  # {warehouse_id: [stocks]}
+    all_prices_data: List[Dict[str, Any]] = []
+    
+    # Остатки обновляем только на складе 1619436
+    TARGET_WAREHOUSE_ID = 1619436
+    
+    for matched in upload_frames:
+        if len(matched) == 0:
+            continue
+        # Данные для обновления цен
+        all_prices_data.extend(matched[['nmID', 'price', 'base_price', 'discount']].to_dict('records'))
+        
+        # Данные для обновления остатков - только на складе 1619436.
+        # Баркод всегда берем из файла "Баркоды.xlsx" (колонка G); используем только sku -
+        # API сам найдет chrtId по sku при обновлении остатков
+        stocks = matched[matched['sku'] != '']
+        all_stocks_data.setdefault(TARGET_WAREHOUSE_ID, []).extend(stocks[['sku', 'amount']].to_dict('records'))
+    
+    if removed_skus:
+        # Товаров больше нет в файлах брендов - обнуляем остатки
+        all_stocks_data.setdefault(TARGET_WAREHOUSE_ID, []).extend({"sku": sku, "amount": 0} for sku in removed_skus)
+    
+    if not all_stocks_data and not all_prices_data:
+        print("\n[INFO] Изменений с прошлой загрузки нет, обновление не требуется")
+        return
+    
+    # Батчи отправляются параллельно и могут завершиться в любом порядке: чтобы
+    # результат был как при последовательной отправке (последнее значение побеждает),
+    # оставляем одну запись на nmID и баркод
+    all_prices_data = list({int(item['nmID']): item for item in all_prices_data}.values())
+    for warehouse_id, stocks in all_stocks_data.items():
+        all_stocks_data[warehouse_id] = list({item['sku']: item for item in stocks}.values())
+    
     # Выводим информацию о том, что будет обновлено
     total_stocks = sum(len(stocks) for stocks in all_stocks_data.values())
     print(f"\nОбновляю: остатков {total_stocks}, цен {len(all_prices_data)}")
     
-    # Обновляем остатки только на складе 1619436
-    TARGET_WAREHOUSE_ID = 1619436
+    def batch_size() -> Any:
+        """Постоянный размер батча или свой адаптивный размер для каждого эндпоинта"""
+        if Config.UPLOAD_BATCH_SIZE > 0:
+            return Config.UPLOAD_BATCH_SIZE
+        return AdaptiveBatchSize(Config.UPLOAD_MAX_BATCH_SIZE, target_latency=Config.UPLOAD_TARGET_LATENCY)
     
+    # Остатки и цены загружаются одновременно, у каждого эндпоинта свой предел параллельных батчей
+    uploads = []
+    labels = []
     if TARGET_WAREHOUSE_ID in all_stocks_data:
-        stocks_data = all_stocks_data[TARGET_WAREHOUSE_ID]
-        warehouse = next((w for w in warehouses if w.get('id') == TARGET_WAREHOUSE_ID), None)
-        warehouse_name = warehouse.get('name', 'Неизвестный склад') if warehouse else 'Неизвестный склад'
-        
-        # Разбиваем на батчи по 100
-        batch_size = 100
-        total_batches = (len(stocks_data) + batch_size - 1) // batch_size
-        for i in range(0, len(stocks_data), batch_size):
-            batch = stocks_data[i:i + batch_size]
-            batch_num = i//batch_size + 1
-            # Показываем прогресс каждые 10 батчей или последний батч
-            if batch_num % 10 == 0 or batch_num == total_batches:
-                print(f"  Остатки: батч {batch_num}/{total_batches}...")
-            if not update_stocks(TARGET_WAREHOUSE_ID, batch):
-                # Если ошибка, делаем задержку перед следующим батчем
-                if i + batch_size < len(stocks_data):
-                    time.sleep(3)
-            
-            # Добавляем небольшую задержку между батчами для избежания 429 ошибок
-            if i + batch_size < len(stocks_data):
-                time.sleep(0.5)
+        uploads.append(upload_batches_async(
+            "Остатки", all_stocks_data[TARGET_WAREHOUSE_ID], partial(update_stocks, TARGET_WAREHOUSE_ID),
+            batch_size=batch_size(), concurrency=Config.STOCKS_CONCURRENCY,
+            max_rejects=Config.UPLOAD_MAX_REJECTS,
+        ))
+        labels.append("Остатки")
     else:
         print(f"  [WARN] Нет данных для обновления остатков на складе {TARGET_WAREHOUSE_ID}")
-    
-    # Обновляем цены
     if all_prices_data:
-        # Разбиваем на батчи по 100
-        batch_size = 100
-        total_batches = (len(all_prices_data) + batch_size - 1) // batch_size
-        for i in range(0, len(all_prices_data), batch_size):
-            batch = all_prices_data[i:i + batch_size]
-            batch_num = i//batch_size + 1
-            # Показываем прогресс каждые 10 батчей или последний батч
-            if batch_num % 10 == 0 or batch_num == total_batches:
-                print(f"  Цены: батч {batch_num}/{total_batches}...")
-            if not update_prices(batch):
-                # Если ошибка, делаем задержку перед следующим батчем
-                if i + batch_size < len(all_prices_data):
-                    time.sleep(3)
-            
-            # Добавляем небольшую задержку между батчами для избежания 429 ошибок
-            if i + batch_size < len(all_prices_data):
-                time.sleep(0.5)
+        uploads.append(upload_batches_async(
+            "Цены", all_prices_data, update_prices,
+            batch_size=batch_size(), concurrency=Config.PRICES_CONCURRENCY,
+            max_rejects=Config.UPLOAD_MAX_REJECTS,
+        ))
+        labels.append("Цены")
+    
+    started = time.perf_counter()
+    upload_results = run_uploads(uploads)
+    results = [result for upload in upload_results for result in upload]
+    failed = [result for result in results if not result.ok]
+    print(f"  Отправлено батчей: {len(results)}, с ошибкой: {len(failed)} ({time.perf_counter() - started:.1f} с)")
+    
+    # Остальные товары отклоненных батчей загружены, ошибочные - в файле для разбора
+    rejected = [entry for result in results for entry in result.rejected]
+    if rejected:
+        written = sum(write_rejects(Config.REJECTS_FILE, label, upload) for label, upload in zip(labels, upload_results))
+        details = f"подробности в {Config.REJECTS_FILE}" if written else "файл отклоненных товаров не записан"
+        print(f"[WARN] WB отклонил товаров: {len(rejected)}, {details}")
+    
+    # Снимок сохраняем только после успешной загрузки, иначе изменения
+    # будут отправлены повторно при следующем запуске
+    if new_snapshots:
+        if not failed:
+            # Решение принимается по результатам загрузки, а не по записи файла отклоненных
+            if rejected:
+                rejected_nmids = {int(item['nmID']) for item, _ in rejected if 'nmID' in item}
+                rejected_skus = {str(item['sku']) for item, _ in rejected if 'sku' in item}
+                # upload_frames и new_snapshots заполнены в одном цикле по брендам
+                forgotten = sum(
+                    forget_rejected(snapshot, old_snapshots[brand], changed, rejected_nmids, rejected_skus)
+                    for (brand, snapshot), changed in zip(new_snapshots.items(), upload_frames)
+                )
+                print(f"[INFO] Отклоненные артикулы ({forgotten}) будут отправлены повторно при следующем запуске")
+            for brand, snapshot in new_snapshots.items():
+                save_brand_snapshot(brand, snapshot)
+            print(f"[INFO] Снимок загруженных данных сохранен: {Config.SNAPSHOT_DIR}")
+        else:
+            print("[WARN] Были ошибки загрузки - снимок не обновлен, изменения будут отправлены повторно")
     
     print("Обновление завершено!")
 
@@ -0,0 +1,818 @@
+"""
+Чтение файлов брендов (brand_{бренд}.csv) и сопоставление товаров с каталогом SKU.
+
+Файл бренда читается потоково, блоками колонок (BrandColumns); большие файлы
+разбираются блоками байт в нескольких процессах. Нормализованные колонки
+сохраняются в кэш (.npy, читаются через mmap) и используются, пока исходный
+CSV не изменился. Товары сопоставляются с каталогом (wb_catalog) по артикулу
+производителя; цены здесь не рассчитываются - результат содержит цену из
+файла бренда (supplier_price).
+
+Несколько брендов обрабатываются параллельно в пуле процессов (ingest_brands).
+
+Использование:
+    source = BrandSource([Path("~/wildberries/price").expanduser(), Path.cwd()])
+    for brand, get_result in ingest_brands(["BOSCH", "MANN"], catalog, source):
+        matched, unmatched, products_count, elapsed = get_result()
+"""
+
+import csv
+import io
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from update_prices import file_sha256
+from wb_catalog import SkuCatalog
+
+# Размер блока товаров при сопоставлении с каталогом
+BRAND_CHUNK_SIZE = 50000
+# Размер блока (байт) при разборе большого файла в нескольких процессах
+BRAND_PARSE_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+class BrandSource:
+    """
+    Где искать файлы брендов и как их читать.
+
+    directories - каталоги в порядке поиска файла brand_{бренд}.csv;
+    chunk_size - размер блока товаров; cache_dir - каталог кэша (None - без
+    кэша); файлы от chunked_parse_mb МБ (0 - никогда) разбираются блоками по
+    parse_chunk_mb МБ в parse_workers процессах (0 - по числу ядер).
+    """
+
+    __slots__ = ('directories', 'chunk_size', 'cache_dir', 'chunked_parse_mb', 'parse_chunk_mb', 'parse_workers')
+
+    def __init__(self, directories: Sequence[Path], chunk_size: int = BRAND_CHUNK_SIZE,
+                 cache_dir: Optional[Path] = None, chunked_parse_mb: float = 256,
+                 parse_chunk_mb: float = 64, parse_workers: int = 0):
+        self.directories = [Path(directory) for directory in directories]
+        self.chunk_size = chunk_size
+        self.cache_dir = cache_dir
+        self.chunked_parse_mb = chunked_parse_mb
+        self.parse_chunk_mb = parse_chunk_mb
+        self.parse_workers = parse_workers
+
+
+class BrandRecord:
+    """Товар из файла бренда: артикул производителя, баркод, цена и количество"""
+
+    __slots__ = ('article', 'barcode', 'price', 'amount')
+
+    def __init__(self, article: Optional[str], barcode: Optional[str], price: float, amount: int):
+        self.article = article
+        self.barcode = barcode
+        self.price = price
+        self.amount = amount
+
+    def __repr__(self) -> str:
+        return f"BrandRecord(article={self.article!r}, barcode={self.barcode!r}, price={self.price}, amount={self.amount})"
+
+
+class BrandColumns:
+    """
+    Блок товаров бренда по колонкам.
+
+    articles и barcodes - списки строк (None - нет значения) или массивы numpy
+    фиксированной ширины из кэша (пустая строка - нет значения);
+    prices (float64) и amounts (int64) - массивы numpy.
+    """
+
+    __slots__ = ('articles', 'barcodes', 'prices', 'amounts')
+
+    def __init__(self, articles: Any, barcodes: Any, prices: 'np.ndarray', amounts: 'np.ndarray'):
+        self.articles = articles
+        self.barcodes = barcodes
+        self.prices = prices
+        self.amounts = amounts
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    @classmethod
+    def from_records(cls, records: List[BrandRecord]) -> 'BrandColumns':
+        """Собирает блок из товаров read_brand_file()"""
+        import numpy as np
+        return cls(
+            [record.article for record in records],
+            [record.barcode for record in records],
+            np.array([record.price for record in records], dtype=np.float64),
+            np.array([record.amount for record in records], dtype=np.int64),
+        )
+
+    def compact(self) -> 'BrandColumns':
+        """Блок с колонками-массивами numpy (строки фиксированной ширины) - для кэша"""
+        import numpy as np
+        return BrandColumns(
+            np.array(['' if article is None else article for article in self.articles], dtype=str),
+            np.array(['' if barcode is None else barcode for barcode in self.barcodes], dtype=str),
+            self.prices,
+            self.amounts,
+        )
+
+    def blocks(self, chunk_size: int) -> Iterator['BrandColumns']:
+        """Делит колонки на блоки по chunk_size строк (срезы без копирования)"""
+        for start in range(0, len(self), chunk_size):
+            end = start + chunk_size
+            yield BrandColumns(self.articles[start:end], self.barcodes[start:end],
+                               self.prices[start:end], self.amounts[start:end])
+
+
+def find_brand_file(brand: str, directories: Sequence[Path]) -> Optional[Path]:
+    """
+    Находит файл brand_{brand}.csv
+
+    Args:
+        brand: Название бренда
+        directories: Каталоги в порядке поиска
+
+    Returns:
+        Optional[Path]: Путь к файлу или None, если файл не найден
+    """
+    brand_file = None
+    for directory in directories:
+        brand_file = Path(directory) / f"brand_{brand}.csv"
+        if brand_file.exists():
+            return brand_file
+
+    print(f"  [WARN] Файл не найден: {brand_file}")
+    return None
+
+
+def open_brand_csv(brand_file: Path) -> Tuple[io.TextIOWrapper, Any]:
+    """
+    Открывает CSV файл бренда, определяя кодировку и разделитель по первому
+    прочитанному блоку (файл открывается один раз).
+
+    Returns:
+        Tuple[io.TextIOWrapper, Any]: Текстовый поток, установленный на начало файла, и диалект csv
+    """
+    raw = open(brand_file, 'rb')
+    try:
+        # Определяем кодировку: первый блок файла должен читаться как UTF-8
+        encoding = 'utf-8'
+        text = io.TextIOWrapper(raw, encoding=encoding)
+        try:
+            sample = text.read(1000)
+        except UnicodeDecodeError:
+            encoding = 'cp1251'
+            text.detach()
+            raw.seek(0)
+            text = io.TextIOWrapper(raw, encoding=encoding)
+            sample = text.read(1000)
+
+        # Определяем разделитель
+        sniffer = csv.Sniffer()
+        try:
+            dialect = sniffer.sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+
+        text.seek(0)
+        return text, dialect
+    except BaseException:
+        raw.close()
+        raise
+
+
+def parse_brand_row(row: List[str]) -> Optional[BrandRecord]:
+    """
+    Разбирает строку CSV файла бренда.
+
+    Структура файла бренда:
+    Колонка A (0) - бренд
+    Колонка B (1) - артикул производителя (F00BH40270, AG 01007, CUK18000-2)
+    Колонка C (2) - описание товара (иногда баркод)
+    Колонка D (3) - цена
+    Колонка E (4) - количество
+
+    Returns:
+        Optional[BrandRecord]: Товар или None, если в строке нет цены или количества
+    """
+    if len(row) < 5:
+        return None
+
+    try:
+        # Извлекаем цену из колонки D (индекс 3)
+        price_str = str(row[3]).strip().replace(',', '.').replace(' ', '').replace('"', '')
+        # Извлекаем количество из колонки E (индекс 4)
+        amount_str = str(row[4]).strip().replace(',', '.').replace(' ', '').replace('"', '')
+
+        price = None
+        amount = None
+
+        if price_str and price_str.lower() not in ['nan', '', 'цена', 'price']:
+            try:
+                price = float(price_str)
+            except ValueError:
+                pass
+
+        if amount_str and amount_str.lower() not in ['nan', '', 'количество', 'amount', 'остаток']:
+            try:
+                amount = int(float(amount_str))
+            except ValueError:
+                pass
+
+        if price is None or amount is None:
+            return None
+
+        # Колонка B (индекс 1) - это артикул производителя
+        manufacturer_art = None
+        if row[1]:
+            potential_manufacturer_art = str(row[1]).strip().replace('"', '').replace("'", '')
+            # Пропускаем заголовки
+            if (potential_manufacturer_art.lower() not in ['бренд', 'brand', 'артикул', 'артикул продавца', 'название', 'name', 'nan', '', 'none'] and
+                len(potential_manufacturer_art) >= 2 and len(potential_manufacturer_art) <= 20):
+                # Убираем пробелы для сопоставления (AG 01007 -> AG01007)
+                manufacturer_art = potential_manufacturer_art.replace(' ', '')
+
+        # Проверяем колонку C (индекс 2) на наличие баркода (маловероятно, но проверим)
+        barcode = None
+        if row[2]:
+            potential_barcode = str(row[2]).strip().replace('"', '').replace("'", '').replace(' ', '').replace('-', '')
+            # Если это длинный баркод (13+ цифр) - EAN-13
+            if len(potential_barcode) >= 13 and potential_barcode.isdigit():
+                barcode = potential_barcode
+
+        return BrandRecord(manufacturer_art, barcode, price, amount)
+    except (ValueError, IndexError, TypeError, OverflowError):
+        return None
+
+
+def iter_brand_records(brand_file: Path) -> Iterator[BrandRecord]:
+    """
+    Построчно читает CSV файл бренда, не загружая его в память целиком.
+
+    Yields:
+        BrandRecord: Товары с ценой и количеством (первая строка - заголовок - пропускается)
+    """
+    text, dialect = open_brand_csv(brand_file)
+    with text:
+        reader = csv.reader(text, dialect=dialect)
+        next(reader, None)  # Заголовок
+        for row in reader:
+            record = parse_brand_row(row)
+            if record is not None:
+                yield record
+
+
+def split_line_ranges(file_path: Path, chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    Делит файл на диапазоны байт размером около chunk_size.
+
+    Каждый диапазон заканчивается сразу после перевода строки (b"\\n" не
+    встречается внутри многобайтовых символов UTF-8 и cp1251), поэтому
+    диапазоны можно декодировать и разбирать независимо.
+
+    Returns:
+        List[Tuple[int, int]]: Список (начало, конец) в порядке файла
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return []
+
+    ranges = []
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = size
+            if start + chunk_size < size:
+                newline = mm.find(b'\n', start + chunk_size)
+                if newline != -1:
+                    end = newline + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _dialect_params(dialect: Any) -> Dict[str, Any]:
+    """Параметры диалекта csv (класс диалекта от Sniffer нельзя передать в другой процесс)"""
+    names = ('delimiter', 'quotechar', 'escapechar', 'doublequote', 'skipinitialspace', 'lineterminator', 'quoting')
+    return {name: getattr(dialect, name) for name in names}
+
+
+def _parse_brand_chunk(file_path: str, start: int, end: int, encoding: str, fmtparams: Dict[str, Any],
+                       skip_header: bool) -> Tuple[List[Optional[str]], List[Optional[str]], List[float], List[int]]:
+    """
+    Разбирает диапазон байт CSV файла бренда (выполняется в процессе пула).
+
+    Returns:
+        Tuple[List, List, List, List]: Колонки article, barcode, price, amount
+        (колонки передаются между процессами быстрее, чем объекты)
+    """
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode(encoding)
+
+    # newline=None - те же универсальные переводы строк, что и при чтении файла целиком
+    reader = csv.reader(io.StringIO(text, newline=None), **fmtparams)
+    if skip_header:
+        next(reader, None)
+
+    articles, barcodes, prices, amounts = [], [], [], []
+    for row in reader:
+        record = parse_brand_row(row)
+        if record is not None:
+            articles.append(record.article)
+            barcodes.append(record.barcode)
+            prices.append(record.price)
+            amounts.append(record.amount)
+    return articles, barcodes, prices, amounts
+
+
+# Предел процессов разбора блоками в процессе пула брендов (0 - без предела, см. _init_brand_worker)
+_worker_parse_workers = 0
+
+
+def iter_brand_records_chunked(brand_file: Path, chunk_size: int = BRAND_PARSE_CHUNK_SIZE,
+                               workers: int = 0) -> Iterator[BrandRecord]:
+    """
+    Разбирает большой CSV файл бренда блоками в нескольких процессах.
+
+    Файл отображается в память (mmap) и делится на диапазоны по границам строк;
+    блоки разбираются параллельно по тем же правилам (parse_brand_row), а товары
+    выдаются в порядке файла. Кодировка и разделитель определяются один раз.
+
+    Ограничение: поля в кавычках с переводами строк внутри не поддерживаются
+    (граница блока может попасть внутрь такого поля).
+
+    Args:
+        brand_file: Путь к CSV файлу
+        chunk_size: Размер блока в байтах
+        workers: Количество процессов (0 - по числу ядер; в процессе пула
+            ingest_brands() - не больше его доли ядер)
+
+    Yields:
+        BrandRecord: Товары с ценой и количеством
+    """
+    text, dialect = open_brand_csv(brand_file)
+    encoding = text.encoding
+    text.close()
+
+    ranges = split_line_ranges(brand_file, chunk_size)
+    workers = workers or os.cpu_count() or 1
+    if _worker_parse_workers:
+        # Внутри процесса пула брендов: вместе пулы не должны занимать больше ядер, чем есть
+        workers = min(workers, _worker_parse_workers)
+    workers = min(workers, len(ranges))
+    parse = partial(_parse_brand_chunk, str(brand_file), encoding=encoding, fmtparams=_dialect_params(dialect))
+
+    def chunk_results() -> Iterator[Tuple[List[Any], ...]]:
+        if workers <= 1:
+            for i, (start, end) in enumerate(ranges):
+                yield parse(start, end, skip_header=(i == 0))
+            return
+
+        # Не больше двух блоков на процесс в очереди - разобранные блоки не копятся в памяти
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for i, (start, end) in enumerate(ranges):
+                pending.append(executor.submit(parse, start, end, skip_header=(i == 0)))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    for articles, barcodes, prices, amounts in chunk_results():
+        for article, barcode, price, amount in zip(articles, barcodes, prices, amounts):
+            yield BrandRecord(article, barcode, price, amount)
+
+
+def _open_brand_records(brand_file: Path, source: BrandSource) -> Iterator[BrandRecord]:
+    """Разбирает CSV файл бренда (большие файлы - блоками в нескольких процессах)"""
+    size_mb = brand_file.stat().st_size / (1024 * 1024)
+    if source.chunked_parse_mb and size_mb >= source.chunked_parse_mb:
+        print(f"  [INFO] Читаю файл блоками ({size_mb:.0f} МБ): {brand_file}")
+        return iter_brand_records_chunked(brand_file, int(source.parse_chunk_mb * 1024 * 1024), source.parse_workers)
+
+    print(f"  [INFO] Читаю файл: {brand_file}")
+    return iter_brand_records(brand_file)
+
+
+def read_brand_file(brand: str, source: BrandSource) -> Iterator[BrandRecord]:
+    """
+    Читает файл бренда и извлекает данные
+
+    Args:
+        brand: Название бренда
+        source: Каталоги и настройки чтения файлов брендов
+
+    Returns:
+        Iterator[BrandRecord]: Товары в порядке файла (читаются по мере обработки)
+    """
+    brand_file = find_brand_file(brand, source.directories)
+    if brand_file is None:
+        return iter(())
+    return _open_brand_records(brand_file, source)
+
+
+def write_json_atomic(path: Path, data: Any) -> None:
+    """Записывает JSON во временный файл рядом и атомарно заменяет им path"""
+    fd, tmp_path = tempfile.mkstemp(suffix='.json', dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+# Версия формата кэша файлов брендов (при изменении правил разбора кэш перестраивается)
+BRAND_CACHE_SCHEMA = '1'
+BRAND_CACHE_COLUMNS = ('articles', 'barcodes', 'prices', 'amounts')
+
+
+def brand_cache_path(brand_file: Path, cache_dir: Path) -> Path:
+    """Каталог кэша нормализованного файла бренда"""
+    return Path(cache_dir) / brand_file.stem
+
+
+def load_brand_cache(brand_file: Path, cache_dir: Path) -> Tuple[Optional[BrandColumns], Optional[str]]:
+    """
+    Открывает кэш нормализованного файла бренда.
+
+    Кэш действителен, пока не изменился исходный CSV: сначала сравниваются
+    путь, размер и mtime, затем хэш содержимого. Колонки отображаются
+    в память (mmap) и читаются по мере обработки.
+
+    Returns:
+        Tuple[Optional[BrandColumns], Optional[str]]: Колонки (None, если кэш
+        устарел или отсутствует) и SHA-256 файла, если он был вычислен
+    """
+    import numpy as np
+
+    cache_path = brand_cache_path(brand_file, cache_dir)
+    meta_path = cache_path / 'meta.json'
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+
+    stat = brand_file.stat()
+    if meta.get('source') != str(brand_file.resolve()) or meta.get('schema') != BRAND_CACHE_SCHEMA:
+        return None, None
+
+    sha256 = None
+    if meta.get('size') != stat.st_size or meta.get('mtime_ns') != stat.st_mtime_ns:
+        sha256 = file_sha256(brand_file)
+        if meta.get('sha256') != sha256:
+            return None, sha256
+        # Файл перезаписан без изменений содержимого
+        meta.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        try:
+            write_json_atomic(meta_path, meta)
+        except OSError:
+            pass
+
+    try:
+        # Пустой файл нельзя отобразить в память
+        mmap_mode = 'r' if meta.get('rows') else None
+        columns = [np.load(cache_path / f"{name}.npy", mmap_mode=mmap_mode) for name in BRAND_CACHE_COLUMNS]
+    except (OSError, ValueError):
+        return None, sha256
+    if any(len(column) != meta.get('rows') for column in columns):
+        return None, sha256
+    return BrandColumns(*columns), sha256
+
+
+class BrandCacheWriter:
+    """
+    Записывает кэш нормализованного файла бренда по мере разбора, блок за блоком.
+
+    Блоки колонок дописываются в промежуточные файлы (в памяти держится только
+    текущий блок), а finish() собирает из них итоговые .npy: ширина строковых
+    колонок известна только после последнего блока. Все пишется во временный
+    каталог, который затем заменяет кэш.
+    """
+
+    def __init__(self, brand_file: Path, cache_dir: Path, sha256: Optional[str] = None):
+        self.brand_file = brand_file
+        self.sha256 = sha256
+        self.cache_path = brand_cache_path(brand_file, cache_dir)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_path = Path(tempfile.mkdtemp(prefix=self.cache_path.name + '.', dir=str(self.cache_path.parent)))
+        self.rows = 0
+        self.dtypes: Dict[str, Any] = {}
+        self.spools: Dict[str, Any] = {}
+        try:
+            for name in BRAND_CACHE_COLUMNS:
+                self.spools[name] = open(self.tmp_path / f"{name}.spool", 'wb')
+        except BaseException:
+            self.abort()
+            raise
+
+    def append(self, block: BrandColumns) -> None:
+        """Дописывает блок из read_brand_file() (None в строковых колонках - пустая строка)"""
+        import numpy as np
+
+        block = block.compact()
+        for name in BRAND_CACHE_COLUMNS:
+            column = getattr(block, name)
+            np.save(self.spools[name], column)
+            dtype = self.dtypes.get(name)
+            self.dtypes[name] = column.dtype if dtype is None else np.promote_types(dtype, column.dtype)
+        self.rows += len(block)
+
+    def finish(self) -> None:
+        """Собирает колонки .npy, пишет meta.json и заменяет старый кэш"""
+        import numpy as np
+
+        try:
+            stat = self.brand_file.stat()
+            sha256 = self.sha256 or file_sha256(self.brand_file)
+            for name in BRAND_CACHE_COLUMNS:
+                spool_path = self.tmp_path / f"{name}.spool"
+                self.spools[name].close()
+                dtype = self.dtypes.get(name, np.dtype(np.float64 if name == 'prices' else
+                                                       np.int64 if name == 'amounts' else str))
+                if self.rows == 0:
+                    # Пустой файл нельзя отобразить в память
+                    np.save(self.tmp_path / f"{name}.npy", np.array([], dtype=dtype))
+                else:
+                    column = np.lib.format.open_memmap(self.tmp_path / f"{name}.npy", mode='w+',
+                                                       dtype=dtype, shape=(self.rows,))
+                    position = 0
+                    with open(spool_path, 'rb') as spool:
+                        while position < self.rows:
+                            block = np.load(spool)
+                            column[position:position + len(block)] = block
+                            position += len(block)
+                    column.flush()
+                    del column
+                spool_path.unlink()
+            # meta.json пишется последним: без него кэш не считается готовым
+            write_json_atomic(self.tmp_path / 'meta.json', {
+                'source': str(self.brand_file.resolve()),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': sha256,
+                'schema': BRAND_CACHE_SCHEMA,
+                'rows': self.rows,
+            })
+            if self.cache_path.exists():
+                shutil.rmtree(self.cache_path)
+            os.replace(self.tmp_path, self.cache_path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self) -> None:
+        """Удаляет недописанный кэш"""
+        for spool in self.spools.values():
+            spool.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+def read_brand_columns(brand: str, source: BrandSource) -> Iterator[BrandColumns]:
+    """
+    Читает файл бренда блоками колонок.
+
+    Если файл не изменился с прошлого запуска, данные берутся из кэша
+    (разбор CSV, определение кодировки и очистка значений пропускаются).
+    Иначе файл разбирается как в read_brand_file(), а нормализованные
+    колонки по мере разбора пишутся в кэш (BrandCacheWriter); кэш
+    становится действительным только после полного прочтения.
+
+    Args:
+        brand: Название бренда
+        source: Каталоги и настройки чтения файлов брендов (кэш - source.cache_dir)
+
+    Yields:
+        BrandColumns: Блоки товаров в порядке файла
+    """
+    chunk_size = source.chunk_size
+    brand_file = find_brand_file(brand, source.directories)
+    if brand_file is None:
+        return
+
+    sha256 = None
+    if source.cache_dir is not None:
+        cached, sha256 = load_brand_cache(brand_file, source.cache_dir)
+        if cached is not None:
+            print(f"  [INFO] Читаю кэш файла ({len(cached)} строк): {brand_file}")
+            yield from cached.blocks(chunk_size)
+            return
+
+    writer = None
+    if source.cache_dir is not None:
+        try:
+            writer = BrandCacheWriter(brand_file, source.cache_dir, sha256)
+        except OSError as e:
+            print(f"  [WARN] Не удалось создать кэш {brand_cache_path(brand_file, source.cache_dir)}: {e}")
+
+    records = _open_brand_records(brand_file, source)
+    try:
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            block = BrandColumns.from_records(chunk)
+            if writer is not None:
+                try:
+                    writer.append(block)
+                except OSError as e:
+                    print(f"  [WARN] Не удалось записать кэш {writer.cache_path}: {e}")
+                    writer.abort()
+                    writer = None
+            yield block
+
+        if writer is not None:
+            try:
+                writer.finish()
+            except OSError as e:
+                print(f"  [WARN] Не удалось сохранить кэш {writer.cache_path}: {e}")
+            writer = None
+    finally:
+        # Файл прочитан не до конца (или ошибка разбора) - недописанный кэш не нужен
+        if writer is not None:
+            writer.abort()
+
+
+def _match_brand_chunk(block: BrandColumns, catalog: SkuCatalog) -> Tuple['pd.DataFrame', List[str]]:
+    """Сопоставляет блок товаров с каталогом (см. match_brand_products)"""
+    import numpy as np
+    import pandas as pd
+
+    prices = np.asarray(block.prices, dtype=np.float64)
+    amounts = np.asarray(block.amounts, dtype=np.int64)
+
+    # Артикулы в файле бренда часто повторяются: нормализуем только уникальные.
+    # Товары без артикула (None или пустая строка из кэша) пропускаются, как и раньше
+    codes, uniques = pd.factorize(np.asarray(block.articles, dtype=object))
+    exact = [str(article).strip() for article in uniques]
+    clean = [article.replace(' ', '').upper() for article in exact]
+    normalized = [article.replace('-', '').replace('/', '').replace('_', '') for article in clean]
+
+    # Соединение с каталогом (индекс SQLite) только по уникальным артикулам
+    unique_found, unique_nmids, unique_barcodes = catalog.match(exact, clean, normalized)
+    has_article = np.array([article != '' for article in uniques], dtype=bool)
+    unique_found &= has_article
+
+    # Цены inf/nan не загружаем
+    found = (codes >= 0) & np.isfinite(prices)
+    found[found] = unique_found[codes[found]]
+    matched_codes = codes[found]
+
+    matched = pd.DataFrame({
+        'nmID': unique_nmids[matched_codes],
+        'supplier_price': prices[found],
+        'sku': unique_barcodes[matched_codes],
+        'amount': amounts[found],
+        'article': np.array(exact, dtype=object)[matched_codes],
+    })
+
+    # Уникальные ненайденные артикулы в порядке первого появления в файле
+    unmatched_codes = np.flatnonzero(~unique_found & has_article)
+    unmatched = list(dict.fromkeys(exact[code] for code in unmatched_codes))
+    return matched, unmatched
+
+
+def match_brand_products(records: Iterable[BrandRecord], catalog: SkuCatalog,
+                         chunk_size: int = BRAND_CHUNK_SIZE) -> Tuple['pd.DataFrame', List[str], int]:
+    """
+    Сопоставляет все товары бренда с каталогом SKU векторными операциями.
+
+    Товары читаются блоками по chunk_size, поэтому файл бренда не нужно
+    держать в памяти целиком. Результат совпадает с поиском catalog.lookup()
+    для каждого товара: сначала точное написание артикула, затем без пробелов,
+    затем нормализованное.
+
+    Args:
+        records: Товары из read_brand_file()
+        catalog: Каталог из read_mapping_files()
+        chunk_size: Размер блока
+
+    Returns:
+        Tuple[pd.DataFrame, List[str], int]:
+            - Найденные товары в порядке файла: колонки nmID, supplier_price (цена
+              из файла бренда), sku, amount (данные для остатков) и article (артикул из файла бренда)
+            - Артикулы, которых нет в файле соответствия (без повторов, в порядке файла)
+            - Количество прочитанных товаров
+    """
+    records = iter(records)
+
+    def blocks() -> Iterator[BrandColumns]:
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                return
+            yield BrandColumns.from_records(chunk)
+
+    return match_brand_columns(blocks(), catalog)
+
+
+def match_brand_columns(blocks: Iterable[BrandColumns], catalog: SkuCatalog) -> Tuple['pd.DataFrame', List[str], int]:
+    """
+    Сопоставляет блоки товаров бренда с каталогом SKU (см. match_brand_products).
+
+    Args:
+        blocks: Блоки из read_brand_columns()
+        catalog: Каталог из read_mapping_files()
+
+    Returns:
+        Tuple[pd.DataFrame, List[str], int]: как у match_brand_products()
+    """
+    import pandas as pd
+
+    frames = []
+    unmatched: Dict[str, None] = {}
+    total = 0
+    for block in blocks:
+        if not len(block):
+            continue
+        total += len(block)
+        matched, block_unmatched = _match_brand_chunk(block, catalog)
+        frames.append(matched)
+        unmatched.update(dict.fromkeys(block_unmatched))
+
+    if not frames:
+        # Пустая таблица с теми же колонками
+        frames.append(_match_brand_chunk(BrandColumns.from_records([]), catalog)[0])
+    matched = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    return matched, list(unmatched), total
+
+
+# Каталог SKU в процессе пула, который читает файлы брендов (см. ingest_brands)
+_worker_catalog: Optional[SkuCatalog] = None
+
+
+def _init_brand_worker(catalog: SkuCatalog, parse_workers: int = 0) -> None:
+    """
+    Инициализация процесса пула: каталог передается один раз, а не с каждой задачей.
+
+    parse_workers - предел процессов для разбора большого файла блоками в этом
+    процессе (0 - без предела).
+    """
+    global _worker_catalog, _worker_parse_workers
+    _worker_catalog = catalog
+    _worker_parse_workers = parse_workers
+
+
+def ingest_brand(brand: str, source: BrandSource,
+                 catalog: Optional[SkuCatalog] = None) -> Tuple['pd.DataFrame', List[str], int, float]:
+    """
+    Читает файл бренда и сопоставляет его с каталогом SKU.
+
+    Args:
+        brand: Название бренда
+        source: Каталоги и настройки чтения файлов брендов
+        catalog: Каталог (по умолчанию - каталог процесса пула)
+
+    Returns:
+        Tuple[pd.DataFrame, List[str], int, float]: результат match_brand_products()
+        и время обработки в секундах
+    """
+    started = time.perf_counter()
+    matched, unmatched, products_count = match_brand_columns(
+        read_brand_columns(brand, source), catalog if catalog is not None else _worker_catalog
+    )
+    return matched, unmatched, products_count, time.perf_counter() - started
+
+
+def ingest_brands(brands: List[str], catalog: SkuCatalog, source: BrandSource,
+                  workers: int = 0) -> Iterator[Tuple[str, Any]]:
+    """
+    Читает и сопоставляет файлы брендов параллельно в пуле процессов.
+
+    Бренды независимы друг от друга, поэтому обрабатываются одновременно,
+    а результаты выдаются в порядке brands - данные для загрузки собираются
+    в том же порядке, что и при последовательной обработке.
+
+    Args:
+        brands: Список брендов
+        catalog: Каталог из read_mapping_files()
+        source: Каталоги и настройки чтения файлов брендов
+        workers: Количество процессов (0 - по числу ядер)
+
+    Yields:
+        Tuple[str, Callable]: бренд и функция, которая возвращает результат
+        ingest_brand() (или выбрасывает его исключение)
+    """
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(brands))
+
+    if workers <= 1:
+        # Один бренд - без накладных расходов на запуск процессов
+        for brand in brands:
+            yield brand, partial(ingest_brand, brand, source, catalog)
+        return
+
+    # Каждый процесс может разбирать большой файл в своем пуле (iter_brand_records_chunked):
+    # делим ядра между процессами, чтобы не запустить workers * ядер процессов
+    parse_workers = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_brand_worker,
+                             initargs=(catalog, parse_workers)) as executor:
+        futures = [(brand, executor.submit(ingest_brand, brand, source)) for brand in brands]
+        for brand, future in futures:
+            yield brand, future.result
@@ -0,0 +1,423 @@
+"""
+Каталог SKU из файла соответствия "Баркоды.xlsx".
+
+Файл баркодов разбирается один раз в постоянный индекс SQLite, который
+перестраивается только при изменении файла (сравниваются размер и mtime,
+затем SHA-256 содержимого). Каталог (SkuCatalog) не загружается в память:
+поиск товара по артикулу, баркоду или nmID - запрос к индексу, а блок
+товаров бренда сопоставляется одним соединением таблиц в SQLite.
+
+Артикул ищется так же, как раньше искался по словарям: сначала точное
+написание, затем без пробелов, затем нормализованное (normalize_article).
+
+Использование:
+    from wb_catalog import read_mapping_files
+    catalog = read_mapping_files(Path(".barcodes_index.sqlite"))
+    record = catalog.lookup("AG 01007")
+"""
+
+import atexit
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from update_prices import file_sha256
+
+
+def normalize_article(article: Any) -> str:
+    """Нормализует артикул производителя: без пробелов и знаков -/_, в верхнем регистре"""
+    return str(article).strip().replace(' ', '').upper().replace('-', '').replace('/', '').replace('_', '')
+
+
+class SkuRecord:
+    """Товар из файла "Баркоды.xlsx": артикул производителя, nmID, баркод и chrtId"""
+
+    __slots__ = ('article', 'nmid', 'barcode', 'chrt_id')
+
+    def __init__(self, article: str, nmid: int, barcode: str, chrt_id: Optional[int] = None):
+        self.article = article
+        self.nmid = nmid
+        self.barcode = barcode
+        self.chrt_id = chrt_id
+
+    def __repr__(self) -> str:
+        return f"SkuRecord(article={self.article!r}, nmid={self.nmid}, barcode={self.barcode!r}, chrt_id={self.chrt_id})"
+
+
+class SkuCatalog:
+    """
+    Каталог SKU поверх индекса SQLite (см. open_sku_index).
+
+    Каталог не загружается в память: поиск по артикулу, баркоду и nmID -
+    запросы к индексу, а сопоставление блока товаров бренда (match) - одно
+    соединение таблиц в SQLite. Индекс строится один раз и перестраивается
+    только при изменении файла баркодов.
+
+    Если в файле несколько разных товаров с одинаковым нормализованным
+    артикулом (например, "AB-1" и "AB/1"), их точные написания хранятся
+    отдельно (sku_key.exact = 1), чтобы точное совпадение артикула имело
+    приоритет над нормализованным, как и раньше.
+
+    Соединение открывается только для чтения и отдельно в каждом процессе,
+    поэтому каталог можно передавать в пул процессов (передается путь к индексу).
+    """
+
+    # Номер записи для ключа: точное написание, затем без пробелов, затем нормализованный артикул
+    _KEY_LOOKUP = """
+        COALESCE(
+            (SELECT sku_id FROM sku_key WHERE key = {exact} AND exact = 1),
+            (SELECT sku_id FROM sku_key WHERE key = {clean} AND exact = 1),
+            (SELECT sku_id FROM sku_key WHERE key = {normalized} AND exact = 0)
+        )
+    """
+
+    def __init__(self, index_path: Optional[Path]):
+        """
+        Args:
+            index_path: Путь к индексу SQLite (None - пустой каталог)
+        """
+        self.index_path = index_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+
+    @classmethod
+    def from_rows(cls, rows: List[Tuple[str, int, str]]) -> 'SkuCatalog':
+        """
+        Строит каталог из строк (артикул, nmID, баркод) в порядке файла.
+
+        Индекс записывается во временный файл, который удаляется при выходе.
+        """
+        if not rows:
+            return cls(None)
+        fd, tmp_name = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        os.unlink(tmp_name)
+        index_path = Path(tmp_name)
+        _write_sku_index(rows, index_path, {'schema': SKU_INDEX_SCHEMA})
+        atexit.register(_remove_file, index_path)
+        return cls(index_path)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Соединение SQLite не передается между процессами
+        return {'index_path': self.index_path}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state['index_path'])
+
+    def _connection(self) -> sqlite3.Connection:
+        """Соединение с индексом только для чтения (свое в каждом процессе)"""
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.index_path.resolve().as_uri() + '?mode=ro', uri=True)
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None and self._conn_pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def _record(self, where: str, params: Tuple[Any, ...]) -> Optional[SkuRecord]:
+        if self.index_path is None:
+            return None
+        row = self._connection().execute(
+            f"SELECT article, nmid, barcode, chrt_id FROM sku WHERE {where} ORDER BY id DESC LIMIT 1", params
+        ).fetchone()
+        return SkuRecord(*row) if row is not None else None
+
+    def lookup(self, article: Any) -> Optional[SkuRecord]:
+        """Находит товар по артикулу производителя (точное написание или нормализованное)"""
+        exact = str(article).strip()
+        clean = exact.replace(' ', '').upper()
+        lookup = self._KEY_LOOKUP.format(exact='?', clean='?', normalized='?')
+        return self._record(f"id = {lookup}", (exact, clean, normalize_article(clean)))
+
+    def match(self, exact: List[str], clean: List[str], normalized: List[str]) -> Tuple['np.ndarray', 'np.ndarray', 'np.ndarray']:
+        """
+        Сопоставляет список артикулов с каталогом одним запросом (см. lookup).
+
+        Args:
+            exact: Артикулы (без пробелов по краям)
+            clean: Они же без пробелов, в верхнем регистре
+            normalized: Они же нормализованные (normalize_article)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: признак найденного артикула,
+            nmID и баркоды (для ненайденных - 0 и None)
+        """
+        import numpy as np
+
+        found = np.zeros(len(exact), dtype=bool)
+        nmids = np.zeros(len(exact), dtype=np.int64)
+        barcodes = np.full(len(exact), None, dtype=object)
+        if self.index_path is None or not exact:
+            return found, nmids, barcodes
+
+        conn = self._connection()
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS match_keys (pos INTEGER PRIMARY KEY, exact TEXT, clean TEXT, normalized TEXT)")
+        conn.execute("DELETE FROM match_keys")
+        conn.executemany("INSERT INTO match_keys VALUES (?, ?, ?, ?)", zip(range(len(exact)), exact, clean, normalized))
+        lookup = self._KEY_LOOKUP.format(exact='k.exact', clean='k.clean', normalized='k.normalized')
+        rows = conn.execute(f"SELECT k.pos, s.nmid, s.barcode FROM match_keys AS k JOIN sku AS s ON s.id = {lookup}").fetchall()
+        conn.execute("DELETE FROM match_keys")
+        if rows:
+            positions, row_nmids, row_barcodes = zip(*rows)
+            positions = np.array(positions, dtype=np.int64)
+            found[positions] = True
+            nmids[positions] = row_nmids
+            barcodes[positions] = row_barcodes
+        return found, nmids, barcodes
+
+    def get_by_barcode(self, barcode: str) -> Optional[SkuRecord]:
+        # При повторах баркода или nmID побеждает последняя строка файла
+        return self._record("barcode = ?", (barcode,))
+
+    def get_by_nmid(self, nmid: int) -> Optional[SkuRecord]:
+        return self._record("nmid = ?", (nmid,))
+
+    def barcode_count(self) -> int:
+        """Количество различных баркодов"""
+        if self.index_path is None:
+            return 0
+        return self._connection().execute("SELECT COUNT(DISTINCT barcode) FROM sku").fetchone()[0]
+
+    def __len__(self) -> int:
+        if self.index_path is None:
+            return 0
+        return self._connection().execute("SELECT COUNT(*) FROM sku_key WHERE exact = 0").fetchone()[0]
+
+    def __bool__(self) -> bool:
+        if self.index_path is None:
+            return False
+        return self._connection().execute("SELECT 1 FROM sku LIMIT 1").fetchone() is not None
+
+
+def _catalog_keys(rows: List[Tuple[str, int, str]]) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Вычисляет ключи каталога по строкам файла баркодов.
+
+    Результат поиска совпадает с прежним последовательным поиском по словарям
+    с ключами трех написаний артикула (исходное, без пробелов, нормализованное):
+    сначала точное написание, затем без пробелов, затем первый в порядке файла
+    артикул с тем же нормализованным видом.
+
+    Returns:
+        Tuple[Dict[str, int], Dict[str, int]]: article_keys и exact_keys для SkuCatalog
+    """
+    last_row: Dict[str, int] = {}  # написание -> последняя строка с этим написанием
+    first_spelling: Dict[str, str] = {}  # нормализованный артикул -> первое написание в файле
+    group_values: Dict[str, set] = {}  # нормализованный артикул -> различные (nmID, баркод)
+    group_spellings: Dict[str, List[str]] = {}
+
+    for i, (article, nmid, barcode) in enumerate(rows):
+        clean = article.replace(' ', '').upper()
+        normalized = normalize_article(clean)
+        first_spelling.setdefault(normalized, article)
+        group_values.setdefault(normalized, set()).add((nmid, barcode))
+        spellings = group_spellings.setdefault(normalized, [])
+        for spelling in (article, clean, normalized):
+            if spelling not in last_row:
+                spellings.append(spelling)
+            last_row[spelling] = i
+
+    article_keys = {normalized: last_row[spelling] for normalized, spelling in first_spelling.items()}
+    exact_keys = {
+        spelling: last_row[spelling]
+        for normalized, spellings in group_spellings.items() if len(group_values[normalized]) > 1
+        for spelling in spellings
+    }
+    return article_keys, exact_keys
+
+
+def _load_barcode_rows(barcode_file: str) -> List[Tuple[str, int, str]]:
+    """
+    Разбирает файл "Баркоды.xlsx" в строки (артикул производителя, nmID, баркод).
+
+    Returns:
+        List[Tuple[str, int, str]]: Корректные строки в порядке файла
+
+    Raises:
+        Exception: Ошибки чтения файла не перехватываются, чтобы не сохранить пустой индекс
+    """
+    import numpy as np
+    import pandas as pd
+
+    # Читаем файл, пропуская первые 4 строки (данные начинаются с 5-й строки)
+    # Структура файла (данные с 5-й строки):
+    # Колонка B (индекс 1) - артикул производителя
+    # Колонка C (индекс 2) - nmID (артикул WB)
+    # Колонка G (индекс 6) - баркод
+    # Читаем только эти три колонки и сразу как строки
+    try:
+        df_barcode = pd.read_excel(barcode_file, header=0, skiprows=4, usecols=[1, 2, 6], dtype=str)
+    except ValueError:
+        # В файле меньше 7 колонок - соответствий нет
+        return []
+
+    manufacturer_art = df_barcode.iloc[:, 0].fillna('').str.strip()
+    nmid_values = pd.to_numeric(df_barcode.iloc[:, 1], errors='coerce')
+    barcode = df_barcode.iloc[:, 2].fillna('').str.strip()
+
+    # Пропускаем заголовки и пустые значения
+    valid = (
+        ~manufacturer_art.str.lower().isin(['артикул', 'артикул производителя', 'nan', ''])
+        & nmid_values.notna() & np.isfinite(nmid_values)
+        & ~barcode.str.lower().isin(['баркод', 'barcode', 'баркод в системе', 'nan', ''])
+        & (barcode.str.len() > 5)
+    )
+
+    # nmID из колонки C: дробная часть отбрасывается
+    nmid = np.trunc(nmid_values[valid]).astype('int64')
+    return list(zip(manufacturer_art[valid].tolist(), nmid.tolist(), barcode[valid].tolist()))
+
+
+# Версия структуры индекса SKU: индекс другой версии перестраивается
+SKU_INDEX_SCHEMA = '4'
+
+
+def _remove_file(path: Path) -> None:
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+
+def _write_sku_index(rows: List[Tuple[str, int, str]], index_path: Path, meta: Dict[str, str]) -> None:
+    """Записывает индекс SQLite по строкам файла баркодов (во временный файл, затем атомарная замена)"""
+    article_keys, exact_keys = _catalog_keys(rows)
+
+    tmp_path = index_path.with_name(index_path.name + '.tmp')
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    conn = sqlite3.connect(str(tmp_path))
+    try:
+        conn.executescript("""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE sku (id INTEGER PRIMARY KEY, article TEXT, nmid INTEGER, barcode TEXT, chrt_id INTEGER);
+            CREATE TABLE sku_key (key TEXT, exact INTEGER, sku_id INTEGER, PRIMARY KEY (key, exact));
+        """)
+        conn.executemany(
+            "INSERT INTO sku (id, article, nmid, barcode) VALUES (?, ?, ?, ?)",
+            ((i, article, nmid, barcode) for i, (article, nmid, barcode) in enumerate(rows))
+        )
+        conn.executemany("INSERT INTO sku_key (key, exact, sku_id) VALUES (?, 0, ?)", article_keys.items())
+        conn.executemany("INSERT INTO sku_key (key, exact, sku_id) VALUES (?, 1, ?)", exact_keys.items())
+        conn.executescript("""
+            CREATE INDEX sku_barcode ON sku (barcode);
+            CREATE INDEX sku_nmid ON sku (nmid);
+        """)
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", meta.items())
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, index_path)
+
+
+def _build_sku_index(barcode_file: str, index_path: Path, sha256: str) -> None:
+    """Строит индекс SQLite из файла баркодов"""
+    stat = os.stat(barcode_file)
+    _write_sku_index(_load_barcode_rows(barcode_file), index_path, {
+        'source': os.path.abspath(barcode_file),
+        'size': str(stat.st_size),
+        'mtime_ns': str(stat.st_mtime_ns),
+        'sha256': sha256,
+        'schema': SKU_INDEX_SCHEMA,
+    })
+
+
+def open_sku_index(barcode_file: str, index_path: Path) -> Path:
+    """
+    Проверяет постоянный индекс SKU (SQLite), построенный из файла баркодов.
+
+    Индекс перестраивается только если изменился исходный xlsx: сначала
+    сравниваются размер и mtime, затем хэш содержимого.
+
+    Args:
+        barcode_file: Путь к файлу "Баркоды.xlsx"
+        index_path: Путь к индексу
+
+    Returns:
+        Path: Путь к актуальному индексу
+    """
+    source = os.path.abspath(barcode_file)
+    stat = os.stat(barcode_file)
+    sha256 = None
+
+    if index_path.exists():
+        conn = None
+        try:
+            conn = sqlite3.connect(str(index_path))
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if meta.get('source') == source and meta.get('schema') == SKU_INDEX_SCHEMA:
+                if meta.get('size') == str(stat.st_size) and meta.get('mtime_ns') == str(stat.st_mtime_ns):
+                    return index_path
+                sha256 = file_sha256(barcode_file)
+                if meta.get('sha256') == sha256:
+                    # Файл перезаписан без изменений содержимого
+                    conn.executemany("UPDATE meta SET value = ? WHERE key = ?", [
+                        (str(stat.st_size), 'size'),
+                        (str(stat.st_mtime_ns), 'mtime_ns'),
+                    ])
+                    conn.commit()
+                    return index_path
+        except sqlite3.DatabaseError:
+            # Поврежденный индекс - перестраиваем
+            pass
+        finally:
+            # Соединение закрывается до того, как _build_sku_index заменит файл
+            if conn is not None:
+                conn.close()
+
+    print(f"[INFO] Строю индекс соответствий: {index_path}")
+    _build_sku_index(barcode_file, index_path, sha256 or file_sha256(barcode_file))
+    return index_path
+
+
+def read_mapping_files(index_path: Path) -> SkuCatalog:
+    """
+    Читает файл соответствия "Баркоды.xlsx"
+
+    Структура файла (данные с 5-й строки):
+    - Колонка B (индекс 1) - артикул производителя
+    - Колонка C (индекс 2) - nmID (артикул WB)
+    - Колонка G (индекс 6) - баркод
+
+    Соответствия хранятся в постоянном индексе SQLite (index_path), который
+    перестраивается только при изменении файла. Каталог не загружается
+    в память: поиск идет запросами к индексу.
+
+    Args:
+        index_path: Путь к индексу (в скрипте - Config.SKU_INDEX_FILE)
+
+    Returns:
+        SkuCatalog: Каталог товаров (пустой, если файл не найден или не прочитан)
+    """
+    # Ищем файл с баркодами
+    barcode_file = None
+    for file in os.listdir('.'):
+        if 'Баркоды' in file and file.endswith('.xlsx'):
+            barcode_file = file
+            break
+
+    if not barcode_file:
+        print("[WARN] Файл 'Баркоды.xlsx' не найден!")
+        return SkuCatalog.from_rows([])
+
+    try:
+        try:
+            catalog = SkuCatalog(open_sku_index(barcode_file, index_path))
+            # Индекс должен открываться на чтение уже здесь, иначе - запасной путь ниже
+            bool(catalog)
+            return catalog
+        except sqlite3.Error as e:
+            # Индекс недоступен (например, нет прав на запись) - разбираем файл
+            print(f"[WARN] Индекс соответствий недоступен ({e}), читаю файл целиком")
+            return SkuCatalog.from_rows(_load_barcode_rows(barcode_file))
+    except Exception as e:
+        print(f"Ошибка при чтении файла баркодов: {e}")
+        import traceback
+        traceback.print_exc()
+        return SkuCatalog.from_rows([])
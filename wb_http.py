@@ -0,0 +1,519 @@
+"""
+Общая HTTP сессия для запросов к API Wildberries.
+
+Все запросы к WB идут через одну сессию requests: соединения с каждым
+хостом (marketplace-api, discounts-prices-api, seller) держатся открытыми
+(keep-alive) и переиспользуются между батчами, поэтому TLS рукопожатие
+выполняется один раз на соединение, а не на каждый запрос. Заголовки
+с токеном задаются один раз при создании сессии.
+
+Частота запросов ограничивается token bucket на каждый эндпоинт (хост + путь).
+Лимиты уточняются по заголовкам ответов WB (X-Ratelimit-Limit, -Remaining,
+-Reset, -Retry, Retry-After): пока есть запас, запросы уходят без пауз,
+а при исчерпании лимита или ответе 429 ждем ровно столько, сколько сказал сервер.
+
+Сбои (429, 5xx, таймауты, разрывы соединения) повторяются с экспоненциальной
+паузой и случайным разбросом; у каждого класса ошибок свой лимит попыток
+(RetryPolicy). Таймауты и разрывы повторяются только для идемпотентных методов
+(GET, PUT, ...): POST мог дойти до сервера, и повтор создал бы, например, вторую
+задачу загрузки цен. POST, который только читает данные, можно разрешить
+повторять блоком with idempotent_requests(). Если хост WB отвечает ошибками подряд, circuit breaker
+приостанавливает все запросы к нему на время cooldown, после чего пропускает
+один пробный запрос.
+
+Использование:
+    from wb_http import get_session
+    session = get_session(get_headers)
+    response = session.post(url, json=payload, timeout=120)
+"""
+
+import atexit
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterator, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+# Количество хостов WB, для которых держится пул соединений
+POOL_CONNECTIONS = int(os.getenv('WB_HTTP_POOL_HOSTS', '4'))
+# Максимум открытых соединений с одним хостом
+POOL_MAXSIZE = int(os.getenv('WB_HTTP_POOL_SIZE', '10'))
+
+# Начальные лимиты (запросов в секунду, запас), пока сервер не сообщил свои в заголовках
+HOST_RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    'discounts-prices-api.wildberries.ru': (10 / 6, 5),
+    'marketplace-api.wildberries.ru': (5.0, 20),
+}
+DEFAULT_RATE_LIMIT: Tuple[float, int] = (
+    float(os.getenv('WB_RATE_LIMIT', '5')),
+    int(os.getenv('WB_RATE_BURST', '5')),
+)
+# Пауза после 429, если сервер не указал время ожидания
+DEFAULT_RETRY_AFTER = 5.0
+
+# Повторов на запрос по классам ошибок (429 - пауза по заголовкам ответа, остальные -
+# экспоненциальная пауза от WB_RETRY_BASE_DELAY до WB_RETRY_MAX_DELAY секунд)
+RETRY_BUDGETS: Dict[str, int] = {
+    'rate_limit': int(os.getenv('WB_RATE_LIMIT_RETRIES', '3')),
+    'server': int(os.getenv('WB_RETRY_SERVER', '4')),
+    'timeout': int(os.getenv('WB_RETRY_TIMEOUT', '3')),
+    'connection': int(os.getenv('WB_RETRY_CONNECTION', '4')),
+}
+RETRY_BASE_DELAY = float(os.getenv('WB_RETRY_BASE_DELAY', '1'))
+RETRY_MAX_DELAY = float(os.getenv('WB_RETRY_MAX_DELAY', '30'))
+# Коды ответа, после которых запрос повторяется как ошибка сервера
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+# Методы, запросы которых повторяются после таймаута или разрыва соединения
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+# Circuit breaker: после сбоев стольких разных запросов подряд запросы к хосту приостанавливаются
+# (повторы одного запроса считаются одним сбоем - один "плохой" батч хост не останавливает)
+BREAKER_THRESHOLD = int(os.getenv('WB_BREAKER_THRESHOLD', '5'))
+# Пауза (с), удваивается при каждом неудачном пробном запросе до BREAKER_MAX_COOLDOWN
+BREAKER_COOLDOWN = float(os.getenv('WB_BREAKER_COOLDOWN', '30'))
+BREAKER_MAX_COOLDOWN = float(os.getenv('WB_BREAKER_MAX_COOLDOWN', '300'))
+
+
+def _header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+    """Числовое значение заголовка (None, если его нет или он не число)"""
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """Время ожидания из Retry-After (секунды или HTTP дата) или X-Ratelimit-Retry"""
+    seconds = _header_float(headers, 'X-Ratelimit-Retry')
+    if seconds is not None:
+        return max(seconds, 0.0)
+
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket одного эндпоинта: rate запросов в секунду, запас capacity.
+
+    acquire() резервирует запрос (токенов может стать меньше нуля) и ждет
+    своей очереди вне блокировки - параллельные запросы распределяются
+    равномерно, а при наличии запаса ожидания нет. Остаток из заголовков
+    уменьшается на запросы, ответ на которые еще не получен.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(float(self.capacity), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """Ждет разрешения на запрос; возвращает время ожидания в секундах"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            self.pending += 1
+            wait = max(-self.tokens / self.rate if self.tokens < 0 else 0.0, self.blocked_until - now)
+        if wait > 0:
+            time.sleep(wait)
+        return max(wait, 0.0)
+
+    def update(self, status_code: int, headers: Mapping[str, str]) -> Optional[float]:
+        """
+        Уточняет лимиты по заголовкам ответа.
+
+        Returns:
+            Optional[float]: Пауза, которую потребовал сервер (для ответа 429)
+        """
+        limit = _header_float(headers, 'X-Ratelimit-Limit')
+        remaining = _header_float(headers, 'X-Ratelimit-Remaining')
+        reset = _header_float(headers, 'X-Ratelimit-Reset')
+        retry_after = retry_after_seconds(headers)
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.pending = max(self.pending - 1, 0)
+            if limit is not None and limit >= 1:
+                self.capacity = int(limit)
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining - self.pending)
+                if reset is not None and reset > 0:
+                    if remaining + 0.5 < self.capacity:
+                        # Израсходованный запас восстанавливается за reset секунд
+                        # (остаток округлен вниз - считаем его в среднем на 0.5 больше)
+                        self.rate = (self.capacity - remaining - 0.5) / reset
+                    if remaining < 1:
+                        self.blocked_until = max(self.blocked_until, now + reset)
+
+            if status_code == 429:
+                wait = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+                self.tokens = min(self.tokens, -float(self.pending))
+                self.blocked_until = max(self.blocked_until, now + wait)
+                return wait
+        return None
+
+
+class RateLimiter:
+    """Token bucket на каждый эндпоинт (хост + путь без параметров)"""
+
+    def __init__(self, host_limits: Optional[Dict[str, Tuple[float, int]]] = None,
+                 default_limit: Tuple[float, int] = DEFAULT_RATE_LIMIT):
+        self.host_limits = HOST_RATE_LIMITS if host_limits is None else host_limits
+        self.default_limit = default_limit
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url: str) -> TokenBucket:
+        """Bucket эндпоинта url"""
+        parts = urlsplit(url)
+        key = f"{parts.netloc}{parts.path}"
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                rate, capacity = self.host_limits.get(parts.hostname or '', self.default_limit)
+                bucket = self._buckets[key] = TokenBucket(rate, capacity)
+            return bucket
+
+
+# Лимитер, общий для всех запросов процесса
+rate_limiter = RateLimiter()
+
+
+class RetryPolicy:
+    """Классы ошибок, лимиты повторов и паузы между попытками"""
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY):
+        self.budgets = RETRY_BUDGETS if budgets is None else budgets
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def classify(status_code: Optional[int] = None, error: Optional[BaseException] = None) -> Optional[str]:
+        """
+        Класс ошибки для повтора.
+
+        Returns:
+            Optional[str]: 'rate_limit', 'server', 'timeout', 'connection' или None
+            (успешный ответ или ошибка, повтор которой не поможет, например 400)
+        """
+        if error is not None:
+            import requests
+            if isinstance(error, requests.exceptions.Timeout):
+                return 'timeout'
+            if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError)):
+                return 'connection'
+            return None
+        if status_code == 429:
+            return 'rate_limit'
+        if status_code in RETRY_STATUS_CODES:
+            return 'server'
+        return None
+
+    def delay(self, attempt: int) -> float:
+        """Экспоненциальная пауза перед попыткой attempt (1, 2, ...) со случайным разбросом"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker хоста WB.
+
+    После сбоев threshold разных запросов подряд (5xx, таймауты, разрывы
+    соединения) размыкается: все запросы к хосту ждут cooldown секунд. Повторы
+    одного запроса считаются одним сбоем, иначе запрос, на который WB всегда
+    отвечает 500 (например, из-за данных), исчерпав свои повторы, останавливал
+    бы весь хост. Затем пропускается один пробный
+    запрос; успех замыкает breaker, сбой размыкает его снова с удвоенной паузой.
+    """
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN,
+                 max_cooldown: float = BREAKER_MAX_COOLDOWN):
+        self.threshold = max(threshold, 1)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self._failed_requests = set()
+        self._condition = threading.Condition()
+
+    @property
+    def is_open(self) -> bool:
+        return self.open_until > 0
+
+    def before_request(self) -> None:
+        """Ждет, пока breaker разомкнут или идет пробный запрос"""
+        with self._condition:
+            while True:
+                if not self.is_open:
+                    return
+                now = time.monotonic()
+                if now < self.open_until:
+                    self._condition.wait(self.open_until - now)
+                elif self.probing:
+                    self._condition.wait()
+                else:
+                    # Пауза прошла - этот запрос пробный
+                    self.probing = True
+                    return
+
+    def record_success(self) -> None:
+        """Хост ответил (в том числе ошибкой клиента или 429) - сбои подряд сбрасываются"""
+        with self._condition:
+            if self.is_open and self.probing:
+                print("    [INFO] API WB снова отвечает, загрузка продолжается")
+            self.failures = 0
+            self._failed_requests.clear()
+            self.open_until = 0.0
+            self.probing = False
+            self.cooldown = self.base_cooldown
+            self._condition.notify_all()
+
+    def release(self) -> None:
+        """Запрос завершился не из-за WB (например, ошибка в данных запроса) - освобождает пробный запрос"""
+        with self._condition:
+            if self.probing:
+                self.probing = False
+                self._condition.notify_all()
+
+    def record_failure(self, request: Optional[object] = None) -> None:
+        """
+        Сбой запроса; при достижении порога (или неудачном пробном запросе) breaker размыкается.
+
+        Args:
+            request: Метка запроса, общая для всех его повторов (None - отдельный запрос)
+        """
+        with self._condition:
+            self._failed_requests.add(object() if request is None else request)
+            self.failures = len(self._failed_requests)
+            if self.probing:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            elif self.is_open or self.failures < self.threshold:
+                return
+            self.probing = False
+            self.open_until = time.monotonic() + self.cooldown
+            print(f"    [WARN] API WB недоступен (сбои {self.failures} запросов подряд), пауза {self.cooldown:.0f} с...")
+            self._condition.notify_all()
+
+
+class CircuitBreakers:
+    """Circuit breaker на каждый хост"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """Breaker хоста url"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker()
+            return breaker
+
+
+# Политика повторов и breakers, общие для всех запросов процесса
+retry_policy = RetryPolicy()
+circuit_breakers = CircuitBreakers()
+
+# Повторы запросов текущего потока по классам ошибок и время последнего
+# HTTP-запроса (см. reset_retry_stats)
+_thread_stats = threading.local()
+
+
+def reset_retry_stats() -> None:
+    """Обнуляет счетчики повторов и время запроса текущего потока (например, перед отправкой батча)"""
+    _thread_stats.retries = {}
+    _thread_stats.latency = None
+
+
+def retry_stats() -> Dict[str, int]:
+    """Повторы запросов текущего потока с последнего reset_retry_stats(): {класс ошибки: количество}"""
+    return dict(getattr(_thread_stats, 'retries', {}))
+
+
+def request_latency() -> Optional[float]:
+    """
+    Время последнего HTTP-запроса текущего потока с последнего reset_retry_stats()
+    (только обмен с сервером - без ожидания лимитера, breaker и пауз между повторами)
+    """
+    return getattr(_thread_stats, 'latency', None)
+
+
+@contextmanager
+def idempotent_requests() -> Iterator[None]:
+    """
+    Запросы текущего потока внутри блока повторяются после таймаута или разрыва
+    соединения независимо от метода (для POST, которые только читают данные)
+    """
+    previous = getattr(_thread_stats, 'idempotent', False)
+    _thread_stats.idempotent = True
+    try:
+        yield
+    finally:
+        _thread_stats.idempotent = previous
+
+
+def _count_retry(error_class: str) -> None:
+    retries = getattr(_thread_stats, 'retries', None)
+    if retries is None:
+        retries = _thread_stats.retries = {}
+    retries[error_class] = retries.get(error_class, 0) + 1
+
+
+def _resilient_adapter(limiter: RateLimiter, policy: RetryPolicy,
+                       breakers: CircuitBreakers) -> 'requests.adapters.HTTPAdapter':
+    """HTTPAdapter с пулом соединений, лимитом частоты запросов, повторами и circuit breaker"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    def retry_is_safe(request, error: BaseException) -> bool:
+        """Можно ли повторить запрос после таймаута или разрыва соединения"""
+        if request.method in IDEMPOTENT_METHODS or getattr(_thread_stats, 'idempotent', False):
+            return True
+        # Соединение не установлено - запрос точно не отправлен
+        return isinstance(error, requests.exceptions.ConnectTimeout)
+
+    class ResilientAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            bucket = limiter.bucket(request.url)
+            breaker = breakers.breaker(request.url)
+            # Метка запроса для breaker: повторы считаются одним сбоем
+            request_token = object()
+            attempts: Dict[str, int] = {}
+            while True:
+                breaker.before_request()
+                bucket.acquire()
+                response = error = None
+                started = time.perf_counter()
+                try:
+                    response = super().send(request, **kwargs)
+                    if not kwargs.get('stream'):
+                        # Тело читаем здесь, чтобы разрыв при чтении тоже повторялся
+                        response.content
+                except Exception as e:
+                    error = e
+                    if policy.classify(error=e) is None:
+                        bucket.update(0, {})
+                        breaker.release()
+                        raise
+                except BaseException:
+                    bucket.update(0, {})
+                    breaker.release()
+                    raise
+                finally:
+                    _thread_stats.latency = time.perf_counter() - started
+
+                if response is not None and error is None:
+                    wait = bucket.update(response.status_code, response.headers)
+                    error_class = policy.classify(status_code=response.status_code)
+                else:
+                    bucket.update(0, {})
+                    wait = None
+                    error_class = policy.classify(error=error)
+
+                if error_class in (None, 'rate_limit'):
+                    # Хост отвечает - сбои подряд не копятся
+                    breaker.record_success()
+                    if error_class is None:
+                        return response
+                else:
+                    breaker.record_failure(request_token)
+
+                if error_class in ('timeout', 'connection') and not retry_is_safe(request, error):
+                    # Запрос мог дойти до сервера - повтор неидемпотентного запроса небезопасен
+                    raise error
+
+                attempt = attempts[error_class] = attempts.get(error_class, 0) + 1
+                if attempt > policy.budgets.get(error_class, 0):
+                    if error is not None:
+                        raise error
+                    return response
+                _count_retry(error_class)
+
+                reason = f"HTTP {response.status_code}" if error is None else type(error).__name__
+                if error_class == 'rate_limit':
+                    # Паузу выдержит лимитер по заголовкам ответа
+                    print(f"    [WARN] Превышен лимит запросов (429), повтор через {wait:.1f} с...")
+                else:
+                    wait = policy.delay(attempt)
+                    print(f"    [WARN] {reason}, повтор {attempt}/{policy.budgets[error_class]} через {wait:.1f} с...")
+                if response is not None:
+                    response.close()
+                if error_class != 'rate_limit':
+                    time.sleep(wait)
+
+    return ResilientAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+
+
+_session = None
+_lock = threading.Lock()
+
+
+def get_session(make_headers: Optional[Callable[[], Dict[str, str]]] = None) -> 'requests.Session':
+    """
+    Возвращает общую сессию (создается при первом вызове).
+
+    Args:
+        make_headers: Функция, возвращающая заголовки сессии (вызывается
+            только при создании сессии - токен читается один раз)
+
+    Returns:
+        requests.Session: Сессия с пулом соединений, ограничением частоты запросов и повторами
+    """
+    global _session
+    if _session is not None:
+        return _session
+
+    with _lock:
+        if _session is None:
+            import requests
+
+            session = requests.Session()
+            adapter = _resilient_adapter(rate_limiter, retry_policy, circuit_breakers)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            if make_headers is not None:
+                session.headers.update(make_headers())
+            atexit.register(close_session)
+            _session = session
+    return _session
+
+
+def close_session() -> None:
+    """Закрывает общую сессию и ее соединения"""
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,297 @@
+"""
+Параллельная загрузка батчей в API Wildberries.
+
+Батчи одного эндпоинта отправляются одновременно, но не больше
+concurrency штук сразу. Запросы выполняются существующими синхронными
+функциями (update_stocks, update_prices, ...) в потоках, через общую
+сессию wb_http - соединения переиспользуются. Результат возвращается
+по каждому батчу.
+
+Размер батча может быть постоянным или адаптивным (AdaptiveBatchSize):
+загрузка начинается с большого батча, а размер уменьшается при ошибках,
+5xx, таймаутах и медленных ответах и снова растет, пока ответы быстрые.
+
+Если сервер отклонил данные батча (функция отправки вызвала reject_batch()),
+батч делится пополам, пока ошибочные товары не останутся по одному:
+остальные товары загружаются, а отклоненные попадают в BatchResult.rejected
+(их можно записать в файл через write_rejects()).
+
+Использование:
+    results = upload_batches("Цены", prices_data, update_prices,
+                             batch_size=AdaptiveBatchSize(maximum=1000), concurrency=2)
+    all_ok = all(result.ok for result in results)
+
+Несколько эндпоинтов загружаются одновременно через run_uploads().
+"""
+
+import asyncio
+import csv
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from wb_http import request_latency, reset_retry_stats, retry_stats
+
+# Ответы WB, которые означают ошибку в данных батча (а не сбой сервера или авторизации)
+REJECT_STATUS_CODES = (400, 409, 422)
+
+_thread_rejection = threading.local()
+
+
+def reject_batch(error_text: str) -> None:
+    """
+    Отмечает, что сервер отклонил данные отправляемого батча.
+
+    Вызывается функцией отправки (в ее потоке) перед тем, как вернуть False:
+    такой батч делится пополам, чтобы найти ошибочные товары.
+    """
+    _thread_rejection.error = error_text
+
+
+class BatchResult:
+    """Результат отправки одного батча"""
+
+    __slots__ = ('number', 'items', 'ok', 'elapsed', 'retries', 'rejected', 'latency')
+
+    def __init__(self, number: int, items: Sequence[Any], ok: bool, elapsed: float,
+                 retries: Optional[Dict[str, int]] = None,
+                 rejected: Optional[List[Tuple[Any, str]]] = None,
+                 latency: Optional[float] = None):
+        self.number = number
+        self.items = items
+        # True - все товары, кроме отклоненных сервером, загружены
+        self.ok = ok
+        # Полное время батча (с ожиданием лимитера) и время последнего HTTP-запроса
+        self.elapsed = elapsed
+        self.latency = latency
+        self.retries = retries or {}
+        # Отклоненные товары и текст ошибки сервера
+        self.rejected = rejected or []
+
+    def __repr__(self) -> str:
+        return (f"BatchResult(number={self.number}, items={len(self.items)}, ok={self.ok}, "
+                f"elapsed={self.elapsed:.2f}, retries={self.retries}, rejected={len(self.rejected)})")
+
+
+class AdaptiveBatchSize:
+    """
+    Размер батча, подстраиваемый по результатам отправки.
+
+    Начинает с initial (по умолчанию - maximum, лимит API). После каждого батча:
+    ошибка, 5xx или таймаут - размер уменьшается вдвое; ответ медленнее
+    target_latency - на четверть; быстрый успешный ответ - растет на четверть
+    (но не больше maximum). Так число товаров в секунду остается высоким,
+    а таймауты - редкими.
+
+    429 размер не уменьшают: WB ограничивает число запросов, а не товаров,
+    и меньшие батчи дали бы только больше запросов на товар. По той же причине
+    скорость ответа берется по самому HTTP-запросу (BatchResult.latency) - ожидание
+    лимитера и breaker не считается медленным ответом сервера.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 10, initial: Optional[int] = None,
+                 target_latency: float = 5.0):
+        self.maximum = max(maximum, 1)
+        self.minimum = max(min(minimum, self.maximum), 1)
+        self.size = min(max(initial or self.maximum, self.minimum), self.maximum)
+        self.target_latency = target_latency
+
+    def record(self, result: BatchResult) -> None:
+        """Учитывает результат батча"""
+        retries = result.retries
+        latency = result.latency if result.latency is not None else result.elapsed
+        if retries.get('timeout') or retries.get('server') or (not result.ok and not retries.get('rate_limit')):
+            self.size = max(self.minimum, self.size // 2)
+        elif latency > self.target_latency:
+            self.size = max(self.minimum, self.size * 3 // 4)
+        elif len(result.items) >= self.size:
+            # Растем только после полного батча (короткий последний батч ничего не говорит о пределе)
+            self.size = min(self.maximum, self.size + max(self.size // 4, 1))
+
+    def __repr__(self) -> str:
+        return f"AdaptiveBatchSize(size={self.size}, minimum={self.minimum}, maximum={self.maximum})"
+
+
+def _send_with_stats(send: Callable[[Sequence[Any]], bool],
+                     batch: Sequence[Any]) -> Tuple[bool, Dict[str, int], Optional[str], Optional[float]]:
+    """
+    Отправляет батч в потоке отправки.
+
+    Returns:
+        Tuple[bool, Dict[str, int], Optional[str], Optional[float]]: Успех, повторы
+            запросов, текст ошибки, если сервер отклонил данные (см. reject_batch),
+            и время последнего HTTP-запроса
+    """
+    reset_retry_stats()
+    _thread_rejection.error = None
+    ok = bool(send(batch))
+    return ok, retry_stats(), None if ok else _thread_rejection.error, request_latency()
+
+
+async def upload_batches_async(label: str, items: Sequence[Any], send: Callable[[Sequence[Any]], bool],
+                               batch_size: Union[int, AdaptiveBatchSize] = 100,
+                               concurrency: int = 4, max_rejects: int = 100) -> List[BatchResult]:
+    """
+    Отправляет батчи одного эндпоинта, держа в работе не больше concurrency батчей.
+
+    Отклоненный сервером батч делится пополам, и половины отправляются заново,
+    пока ошибочные товары не останутся по одному - это O(k log n) лишних запросов
+    для k ошибочных товаров в батче из n.
+
+    Args:
+        label: Название для вывода прогресса ("Остатки", "Цены")
+        items: Данные для отправки
+        send: Функция отправки одного батча (True - успешно)
+        batch_size: Постоянный размер батча или AdaptiveBatchSize (размер
+            следующего батча выбирается в момент его отправки)
+        concurrency: Максимум одновременно отправляемых батчей (частоту запросов
+            дополнительно ограничивает лимитер общей сессии wb_http)
+        max_rejects: После стольких отклоненных товаров батчи больше не делятся
+            (если ошибочны почти все данные, деление стоило бы ~2n запросов) -
+            такие батчи считаются неуспешными
+
+    Returns:
+        List[BatchResult]: Результаты в порядке батчей
+    """
+    if not items:
+        return []
+
+    sizer = batch_size if isinstance(batch_size, AdaptiveBatchSize) else None
+    total = len(items)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    sent = 0
+    done = 0
+    rejects_left = max_rejects
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        async def attempt(number: int,
+                          batch: Sequence[Any]) -> Tuple[bool, Dict[str, int], Optional[str], Optional[float]]:
+            try:
+                return await loop.run_in_executor(executor, _send_with_stats, send, batch)
+            except Exception as e:
+                print(f"    [ERROR] {label}: батч {number} - {e}")
+                return False, {}, None, None
+
+        async def isolate(number: int, batch: Sequence[Any], error: str) -> Tuple[bool, List[Tuple[Any, str]]]:
+            """Делит отклоненную часть батча пополам до отдельных ошибочных товаров"""
+            nonlocal rejects_left
+            if len(batch) == 1:
+                rejects_left -= 1
+                return True, [(batch[0], error)]
+            if rejects_left <= 0:
+                return False, []
+            ok = True
+            rejected: List[Tuple[Any, str]] = []
+            middle = len(batch) // 2
+            for part in (batch[:middle], batch[middle:]):
+                part_ok, _, part_error, _ = await attempt(number, part)
+                if part_ok:
+                    continue
+                if part_error is None:
+                    ok = False
+                    continue
+                part_ok, part_rejected = await isolate(number, part, part_error)
+                ok = ok and part_ok
+                rejected.extend(part_rejected)
+            return ok, rejected
+
+        async def run(number: int, batch: Sequence[Any]) -> BatchResult:
+            nonlocal sent, done
+            started = time.perf_counter()
+            rejected: List[Tuple[Any, str]] = []
+            try:
+                ok, retries, error, latency = await attempt(number, batch)
+                first = BatchResult(number, batch, ok, time.perf_counter() - started, retries, latency=latency)
+                if error is not None:
+                    print(f"    [WARN] {label}: батч {number} отклонен сервером, ищу ошибочные товары...")
+                    ok, rejected = await isolate(number, batch, error)
+                    print(f"    [WARN] {label}: батч {number} - отклонено товаров: {len(rejected)}"
+                          f"{'' if ok else ', часть батча не загружена'}")
+            finally:
+                # Слот держится и на время деления батча, чтобы не превышать concurrency
+                semaphore.release()
+            result = BatchResult(number, batch, ok, time.perf_counter() - started, retries, rejected, latency)
+            # Отклоненные данные ничего не говорят о нагрузке - такой батч не меняет размер
+            if sizer is not None and error is None:
+                sizer.record(first)
+            sent += len(batch)
+            done += 1
+            # Показываем прогресс каждые 10 батчей или последний батч
+            if done % 10 == 0 or sent == total:
+                size_info = f", размер батча {sizer.size}" if sizer is not None else ""
+                print(f"  {label}: отправлено {sent}/{total} ({done} батчей{size_info})...")
+            return result
+
+        tasks = []
+        cursor = 0
+        while cursor < total:
+            # Размер следующего батча берется в момент, когда освобождается слот
+            await semaphore.acquire()
+            size = sizer.size if sizer is not None else batch_size
+            batch = items[cursor:cursor + size]
+            cursor += len(batch)
+            tasks.append(asyncio.ensure_future(run(len(tasks) + 1, batch)))
+
+        return list(await asyncio.gather(*tasks))
+
+
+async def _gather(uploads: Sequence[Awaitable[List[BatchResult]]]) -> List[List[BatchResult]]:
+    return list(await asyncio.gather(*uploads))
+
+
+def run_uploads(uploads: Sequence[Awaitable[List[BatchResult]]]) -> List[List[BatchResult]]:
+    """
+    Выполняет загрузки нескольких эндпоинтов одновременно.
+
+    Args:
+        uploads: Корутины upload_batches_async()
+
+    Returns:
+        List[List[BatchResult]]: Результаты каждой загрузки в том же порядке
+    """
+    return asyncio.run(_gather(uploads))
+
+
+def upload_batches(label: str, items: Sequence[Any], send: Callable[[Sequence[Any]], bool],
+                   batch_size: Union[int, AdaptiveBatchSize] = 100, concurrency: int = 4,
+                   max_rejects: int = 100) -> List[BatchResult]:
+    """Синхронная обертка над upload_batches_async() для одного эндпоинта"""
+    return run_uploads([upload_batches_async(label, items, send, batch_size, concurrency, max_rejects)])[0]
+
+
+def write_rejects(path: Path, label: str, results: Sequence[BatchResult]) -> int:
+    """
+    Дописывает отклоненные сервером товары в CSV файл (дата;данные;товар;ошибка).
+
+    Args:
+        path: Файл отклоненных товаров (создается с заголовком, если его нет)
+        label: Название данных ("Остатки", "Цены")
+        results: Результаты upload_batches()
+
+    Returns:
+        int: Количество записанных товаров
+    """
+    rejected = [entry for result in results for entry in result.rejected]
+    if not rejected:
+        return 0
+
+    path = Path(path)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        is_new = not path.exists() or path.stat().st_size == 0
+        with open(path, 'a', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, delimiter=';')
+            if is_new:
+                writer.writerow(['дата', 'данные', 'товар', 'ошибка'])
+            for item, error in rejected:
+                writer.writerow([now, label, json.dumps(item, ensure_ascii=False, default=str), error])
+    except OSError as e:
+        print(f"  [WARN] Не удалось записать отклоненные товары в {path}: {e}")
+        return 0
+    return len(rejected)